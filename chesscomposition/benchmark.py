@@ -1,10 +1,38 @@
-"""Simple benchmark to measure the runtime of example chessboards configs"""
+"""Benchmark measuring the runtime of example chessboards configs.
 
-import time
+Every config is run a number of times after warmup runs and the median
+and 95th percentile of the wall time are reported together with the
+number of examined search nodes, found solutions per second and the peak
+memory allocated by Python. Nodes and memory are measured in separate
+runs, so that the timed runs are not slowed down.
+
+Results can be written as JSON and compared against a stored baseline,
+e.g.
+
+    benchmark.py --json baseline.json
+    benchmark.py --baseline baseline.json --max-slowdown 10
+
+exits with status 1 when any config is more than 10% slower than in the
+baseline.
+
+With --cross-check every config is also searched with a reference engine
+and the exit status is 1 when the solutions of the engines differ, e.g.
+
+    benchmark.py --engine propagation --cross-check set
+"""
+
+from __future__ import print_function
+import argparse
+import json
 import logging
+import sys
+import tracemalloc
+from collections import OrderedDict
+from timeit import default_timer
 
 import pieces as pcs
 import piececomposer as composer
+import searchstats
 
 
 logging.basicConfig(level=logging.INFO)
@@ -59,21 +87,275 @@ BENCH_PARAMS5 = {
 }
 
 
+# few long-range pieces on a larger chessboard
+BENCH_PARAMS6 = {
+    'rows': 8,
+    'cols': 8,
+    'piece_types': (pcs.Queen,) * 8
+}
+
+
+BENCH_CONFIGS = OrderedDict((
+    ('params1', BENCH_PARAMS1),
+    ('params2', BENCH_PARAMS2),
+    ('params3', BENCH_PARAMS3),
+    ('params4', BENCH_PARAMS4),
+    ('params5', BENCH_PARAMS5),
+    ('params6', BENCH_PARAMS6)
+))
+
+
+# the scaling matrix places the first n of these pieces
+MATRIX_PIECES = (
+    pcs.Queen, pcs.Rook, pcs.Bishop, pcs.Knight, pcs.King,
+    pcs.Knight, pcs.Bishop, pcs.King
+)
+MATRIX_SIZES = (4, 5, 6)
+MATRIX_PIECE_COUNTS = (3, 4, 5)
+
+
+def matrix_configs(sizes=MATRIX_SIZES, piece_counts=MATRIX_PIECE_COUNTS):
+    """Get board size x piece count configs of the scaling matrix."""
+    configs = OrderedDict()
+    for size in sizes:
+        for piece_count in piece_counts:
+            configs['matrix_{0}x{0}_{1}'.format(size, piece_count)] = {
+                'rows': size,
+                'cols': size,
+                'piece_types': MATRIX_PIECES[:piece_count]
+            }
+
+    return configs
+
+
+def percentile(values, percent):
+    """Get the nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    rank = max(0, -(-len(ordered) * percent // 100) - 1)
+
+    return ordered[int(rank)]
+
+
+def run_once(params, engine, count_only, stats=None, ordering='static',
+             prune=None):
+    """Run the composer once, returns it together with the solution count."""
+    piece_composer = composer.PieceComposer(
+        engine=engine, ordering=ordering, prune=prune,
+        stats=stats, **params)
+    if count_only:
+        solution_count, _ = piece_composer.count()
+    else:
+        piece_composer.compute()
+        solution_count = len(piece_composer.found_compositions)
+
+    return piece_composer, solution_count
+
+
+def run_config(params, engine='set', count_only=False, warmup=1, repeats=5,
+               memory=True, ordering='static', prune=None):
+    """Benchmark a single config, returns a dict of measurements."""
+    options = {'ordering': ordering, 'prune': prune}
+    for _ in range(warmup):
+        run_once(params, engine, count_only, **options)
+
+    times = []
+    for _ in range(repeats):
+        time0 = default_timer()
+        _, solution_count = run_once(params, engine, count_only, **options)
+        times.append(default_timer() - time0)
+
+    stats = searchstats.SearchStats()
+    run_once(params, engine, count_only, stats=stats, **options)
+
+    median = percentile(times, 50)
+    result = OrderedDict((
+        ('rows', params['rows']),
+        ('cols', params['cols']),
+        ('pieces', [PieceClass.NAME for PieceClass in params['piece_types']]),
+        ('median', median),
+        ('p95', percentile(times, 95)),
+        ('times', times),
+        ('nodes', stats.nodes),
+        # None for engines which do not count pruned branches
+        ('pruned', stats.as_dict().get('pruned')),
+        ('solutions', solution_count),
+        ('solutions_per_second', solution_count / median if median else None),
+        ('peak_memory', None)
+    ))
+
+    if memory:
+        tracemalloc.start()
+        try:
+            run_once(params, engine, count_only, **options)
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return result
+
+
+def cross_check(params, engine, reference, count_only, ordering='static',
+                prune=None):
+    """Check that an engine finds the same solutions as a reference engine.
+
+    Returns a description of the difference, or None when they agree.
+    """
+    piece_composer, _ = run_once(
+        params, engine, count_only, ordering=ordering, prune=prune)
+    reference_composer, _ = run_once(params, reference, count_only)
+
+    if count_only:
+        counts = (piece_composer.solution_count,
+                  piece_composer.canonical_count)
+        reference_counts = (reference_composer.solution_count,
+                            reference_composer.canonical_count)
+        if counts != reference_counts:
+            return "counts {} differ from {}".format(
+                counts, reference_counts)
+        return None
+
+    found = piece_composer.found_compositions
+    reference_found = reference_composer.found_compositions
+    if found != reference_found:
+        return "{} compositions missing, {} unexpected".format(
+            len(reference_found - found), len(found - reference_found))
+    return None
+
+
+def compare(results, baseline, max_slowdown):
+    """Compare median times with a baseline.
+
+    Returns a list of (config name, baseline median, median) tuples
+    of configs slower by more than `max_slowdown` percent.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        baseline_median = baseline[name]['median']
+        if result['median'] > baseline_median * (1 + max_slowdown / 100.0):
+            regressions.append((name, baseline_median, result['median']))
+
+    return regressions
+
+
+def setup_args():
+    """Set up parse arguments."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the piece composer on example configs.")
+    parser.add_argument(
+        '--config', action='append',
+        help='Run only the given configs (may be repeated)')
+    parser.add_argument(
+        '--no-matrix', action='store_true',
+        help='Skip the board size x piece count matrix')
+    parser.add_argument(
+        '--engine', choices=sorted(composer.PieceComposer.ENGINES),
+        default='set', help='Chessboard engine used for the search')
+    parser.add_argument(
+        '--prune', choices=[
+            prune for prune in composer.PieceComposer.PRUNES if prune],
+        help='Cut branches without enough free (or legal) squares left')
+    parser.add_argument(
+        '--ordering', choices=composer.PieceComposer.ORDERINGS,
+        default='static',
+        help="Order of placed pieces, 'dynamic' requires the stack engine")
+    parser.add_argument(
+        '--cross-check', metavar='ENGINE',
+        choices=sorted(composer.PieceComposer.ENGINES),
+        help='Check the solutions against another engine')
+    parser.add_argument(
+        '--count-only', action='store_true',
+        help='Benchmark counting instead of computing the compositions')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help='Skip the traced run measuring peak memory')
+    parser.add_argument(
+        '--json', metavar='FILE',
+        help="Write the results as JSON, '-' for stdout")
+    parser.add_argument(
+        '--baseline', metavar='FILE',
+        help='JSON results to compare the median times with')
+    parser.add_argument(
+        '--max-slowdown', type=float, default=10.0,
+        help='Allowed slowdown against the baseline in percent')
+
+    return parser.parse_args()
+
+
 def main():
     """Main benchmark function."""
-    piece_composer = composer.PieceComposer(**BENCH_PARAMS4)
+    args = setup_args()
 
-    time0 = time.time()
+    configs = OrderedDict(BENCH_CONFIGS)
+    if not args.no_matrix:
+        configs.update(matrix_configs())
+    if args.config:
+        unknown = set(args.config).difference(configs)
+        if unknown:
+            print("Unknown configs: {}".format(", ".join(sorted(unknown))))
+            return 2
+        configs = OrderedDict(
+            (name, configs[name]) for name in args.config)
 
-    piece_composer.compute()
+    # the table goes to stderr when JSON is written to stdout
+    out = sys.stderr if args.json == '-' else sys.stdout
 
-    time1 = time.time()
+    results = OrderedDict()
+    mismatches = []
+    for name, params in configs.items():
+        result = run_config(
+            params, engine=args.engine, count_only=args.count_only,
+            warmup=args.warmup, repeats=args.repeats,
+            memory=not args.no_memory, ordering=args.ordering,
+            prune=args.prune)
+        results[name] = result
+        print(
+            "{:<18} median {:.4f}s p95 {:.4f}s nodes {} solutions {} "
+            "peak memory {}".format(
+                name, result['median'], result['p95'], result['nodes'],
+                result['solutions'], result['peak_memory']),
+            file=out)
+        if args.cross_check is not None:
+            difference = cross_check(
+                params, args.engine, args.cross_check, args.count_only,
+                ordering=args.ordering, prune=args.prune)
+            if difference is not None:
+                mismatches.append(name)
+                print("Mismatch in {} against {}: {}".format(
+                    name, args.cross_check, difference), file=out)
+
+    report = OrderedDict((
+        ('engine', args.engine),
+        ('ordering', args.ordering),
+        ('prune', args.prune),
+        ('count_only', args.count_only),
+        ('results', results)
+    ))
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, args.max_slowdown)
+        for name, baseline_median, median in regressions:
+            print("Regression in {}: {:.4f}s -> {:.4f}s".format(
+                name, baseline_median, median), file=out)
+        if regressions:
+            return 1
+
+    if mismatches:
+        return 1
+
+    return 0
 
-    print("Found compositions in {}".format(time1 - time0))
-    print(
-        "Number of found compositions: {}".format(
-            len(piece_composer.found_compositions))
-    )
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
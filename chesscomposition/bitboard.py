@@ -0,0 +1,199 @@
+"""Module containing a bitboard implementation of the chessboard."""
+
+import pieces as pcs
+
+
+def attack_masks(PieceClass, rows, cols):
+    """Get attack bitmasks of a piece type for every chessboard square.
+
+    The squares are numbered in row-major order, i.e. the (row, column)
+    position corresponds to bit number row * cols + column. The returned
+    tuple is indexed by the square number of the attacking piece and is
+    shared through the pieces.attack_tables cache.
+    """
+    return pcs.attack_table(PieceClass, rows, cols).masks
+
+
+def popcount(mask):
+    """Get the number of set bits of a bitmask."""
+    return bin(mask).count('1')
+
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+
+
+def reverse_masks(masks):
+    """Get masks of squares from which a piece attacks every square."""
+    reverse = [0] * len(masks)
+    for square, mask in enumerate(masks):
+        while mask:
+            low_bit = mask & -mask
+            reverse[low_bit.bit_length() - 1] |= 1 << square
+            mask ^= low_bit
+
+    return reverse
+
+
+class BitChessboard(object):
+    """Represents chessboard with occupied and threatened positions stored
+    as integer bitmasks.
+
+    This is a drop-in replacement of chessboard.Chessboard - positions are
+    still accessed using the (row, column) convention, but internally every
+    position is mapped to a single bit of the `occupied` and `threatened`
+    integers. Attack masks of every piece type are computed once for all
+    squares of the chessboard (see pieces.attack_tables), so adding a piece
+    is just a couple of bitwise operations.
+
+    Threatened positions are not reference counted. Instead, the threatened
+    mask is saved on a stack every time a piece is added and restored when
+    the last added piece is removed.
+    """
+
+    def __init__(self, rows, cols, add_threatened=False):
+        self.pieces = []
+        self.occupied = 0
+        self.threatened = 0
+        self._threatened_stack = []
+        self._attack_tables = {}
+        self._reverse_masks = {}
+        self._rows = rows
+        self._cols = cols
+        self._is_square = (rows == cols)
+
+        self.add_threatened = add_threatened
+
+    @property
+    def rows(self):
+        return self._rows
+
+    @property
+    def cols(self):
+        return self._cols
+
+    @property
+    def is_square(self):
+        return self._is_square
+
+    @property
+    def occupied_positions(self):
+        return self.positions(self.occupied)
+
+    @property
+    def threatened_positions(self):
+        return self.positions(self.threatened)
+
+    @property
+    def blocked_positions(self):
+        """Get both currently occupied and threatened positions."""
+        return self.positions(self.blocked)
+
+    @property
+    def blocked(self):
+        """Get the bitmask of occupied and threatened positions."""
+        if not self.add_threatened:
+            return self.occupied | self.threatened
+
+        return self.occupied
+
+    def positions(self, mask):
+        """Convert a bitmask to a set of (row, column) positions."""
+        positions = set()
+        while mask:
+            low_bit = mask & -mask
+            row, col = divmod(low_bit.bit_length() - 1, self._cols)
+            positions.add((row, col))
+            mask ^= low_bit
+
+        return positions
+
+    def attack_table(self, PieceClass):
+        """Get the attack table of a piece type for this chessboard."""
+        table = self._attack_tables.get(PieceClass)
+        if table is None:
+            table = pcs.attack_table(PieceClass, self._rows, self._cols)
+            self._attack_tables[PieceClass] = table
+
+        return table
+
+    def attack_masks(self, PieceClass):
+        """Get attack masks of a piece type for every square."""
+        return self.attack_table(PieceClass).masks
+
+    def free_count(self):
+        """Get the number of positions which are not blocked."""
+        return self._rows * self._cols - popcount(self.blocked)
+
+    def legal_count(self, PieceClass):
+        """Get the number of positions a piece type could be added to."""
+        reverse = self._reverse_masks.get(PieceClass)
+        if reverse is None:
+            reverse = reverse_masks(self.attack_masks(PieceClass))
+            self._reverse_masks[PieceClass] = reverse
+
+        # positions from which the piece would attack a placed piece
+        attacking = 0
+        occupied = self.occupied
+        while occupied:
+            low_bit = occupied & -occupied
+            attacking |= reverse[low_bit.bit_length() - 1]
+            occupied ^= low_bit
+        full = (1 << (self._rows * self._cols)) - 1
+
+        return popcount(full & ~(self.blocked | attacking))
+
+    def is_blocked(self, pos):
+        """Check if a position is occupied or threatened."""
+        return bool(self.blocked >> (pos[0] * self._cols + pos[1]) & 1)
+
+    def add(self, piece, pos):
+        """Add a chess piece to a chessboard.
+
+        Returns True or False depending if addition succeeded or failed.
+        """
+        square = pos[0] * self._cols + pos[1]
+        if self.blocked >> square & 1:
+            return False
+
+        # check if new possible moves don't threaten existing pieces
+        table = self.attack_table(piece.__class__)
+        mask = table.masks[square]
+        if mask & self.occupied:
+            return False
+
+        piece.place(pos, self._rows, self._cols, table.moves[square])
+
+        self._threatened_stack.append(self.threatened)
+        self.threatened |= mask
+        self.occupied |= 1 << square
+
+        self.pieces.append(piece)
+
+        return True
+
+    def remove(self, piece):
+        """Remove a chess piece from the chessboard."""
+        if piece not in self.pieces:
+            return False
+
+        row, col = piece.position
+        self.occupied &= ~(1 << (row * self._cols + col))
+
+        if piece is self.pieces[-1]:
+            self.pieces.pop()
+            self.threatened = self._threatened_stack.pop()
+        else:
+            # rebuild the saved threatened masks without the removed piece
+            self.pieces.remove(piece)
+            self._threatened_stack = []
+            self.threatened = 0
+            for other in self.pieces:
+                row, col = other.position
+                self._threatened_stack.append(self.threatened)
+                self.threatened |= self.attack_masks(other.__class__)[
+                    row * self._cols + col]
+
+        piece.reset()
+
+        return True
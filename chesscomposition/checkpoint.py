@@ -0,0 +1,240 @@
+"""Module for running long searches which can be resumed after being killed.
+
+The search is split into subtrees (see PieceComposer.split) which are
+searched one after another. The progress - which subtrees are done, the
+solution counts so far and the size of the output file after the last
+finished subtree - is saved periodically to a JSON checkpoint file.
+A resumed search truncates the output file to the saved size and searches
+only the subtrees which are not done.
+"""
+
+import json
+import multiprocessing
+import os
+import tempfile
+from timeit import default_timer
+
+import piececomposer as composer
+import pieces as pcs
+import solutionfile
+
+
+class Checkpoint(object):
+    """Represents the progress of a search saved in a file.
+
+    prefixes - positions of the first pieces of all subtrees
+    done - indices of the finished subtrees
+    offset - size of the output file after the last finished subtree,
+        None without an output file
+    """
+
+    VERSION = 1
+
+    # number of subtrees the search is split into at least, finer
+    # subtrees lose less work when the search is killed
+    MIN_PREFIXES = 64
+
+    def __init__(self, path, rows, cols, piece_types, options=None,
+                 count_only=False, output=None, prefixes=None):
+        self.path = path
+        self.rows = rows
+        self.cols = cols
+        self.piece_types = tuple(piece_types)
+        # PieceComposer keyword arguments selecting the search algorithm
+        self.options = dict(options or {})
+        self.count_only = count_only
+        self.output = output
+        self.prefixes = prefixes
+        self.done = set()
+        self.solution_count = 0
+        self.canonical_count = 0
+        self.offset = None
+
+    @property
+    def finished(self):
+        return self.prefixes is not None and len(self.done) == len(
+            self.prefixes)
+
+    def as_dict(self):
+        return {
+            'version': self.VERSION,
+            'rows': self.rows,
+            'cols': self.cols,
+            'pieces': [PieceClass.NAME for PieceClass in self.piece_types],
+            # fairy pieces are defined again when the search is resumed
+            'definitions': pcs.definitions(self.piece_types),
+            'options': self.options,
+            'count_only': self.count_only,
+            'output': self.output,
+            'prefixes': [
+                [list(position) for position in prefix]
+                for prefix in self.prefixes
+            ],
+            'done': sorted(self.done),
+            'counts': [self.solution_count, self.canonical_count],
+            'offset': self.offset
+        }
+
+    def save(self):
+        """Write the checkpoint to a temporary file and move it to the path."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'w') as temp_file:
+                json.dump(self.as_dict(), temp_file)
+            os.rename(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, classes=None):
+        """Read a checkpoint saved by save()."""
+        with open(path) as checkpoint_file:
+            try:
+                data = json.load(checkpoint_file)
+            except ValueError:
+                raise ValueError("Not a checkpoint file: {}".format(path))
+        if not isinstance(data, dict) or data.get('version') != cls.VERSION:
+            raise ValueError("Not a checkpoint file: {}".format(path))
+
+        pcs.define_pieces(data.get('definitions', []))
+        classes = classes if classes is not None else (
+            solutionfile.piece_classes())
+        checkpoint = cls(
+            path, data['rows'], data['cols'],
+            [classes[name] for name in data['pieces']],
+            options=data['options'], count_only=data['count_only'],
+            output=data['output'],
+            prefixes=[
+                tuple(tuple(position) for position in prefix)
+                for prefix in data['prefixes']
+            ]
+        )
+        checkpoint.done = set(data['done'])
+        checkpoint.solution_count, checkpoint.canonical_count = data['counts']
+        checkpoint.offset = data['offset']
+
+        return checkpoint
+
+
+class CheckpointedSearch(object):
+    """Searches the subtrees of a checkpoint and saves its progress.
+
+    The checkpoint is saved after a finished subtree when more than
+    `interval` seconds passed since it was last saved, and at the end of
+    the search. Without an output file only the solutions are counted.
+    """
+
+    def __init__(self, checkpoint, workers=None, interval=60.0):
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.interval = interval
+
+    def run(self):
+        """Search the remaining subtrees.
+
+        Returns the (solutions, canonical solutions) counts of the whole
+        search.
+        """
+        checkpoint = self.checkpoint
+        if checkpoint.prefixes is None:
+            piece_composer = composer.PieceComposer(
+                checkpoint.rows, checkpoint.cols, checkpoint.piece_types,
+                **checkpoint.options)
+            checkpoint.prefixes = piece_composer.split(
+                max(checkpoint.MIN_PREFIXES,
+                    (self.workers or 1) * piece_composer.PREFIXES_PER_WORKER))
+
+        output = self.open_output()
+        try:
+            checkpoint.save()
+            writer = None
+            if output is not None:
+                writer = solutionfile.SolutionWriter(
+                    output, checkpoint.rows, checkpoint.cols,
+                    checkpoint.piece_types, write_header=False)
+
+            saved = default_timer()
+            for index, result in self.results():
+                checkpoint.solution_count += result[0]
+                checkpoint.canonical_count += result[1]
+                if writer is not None:
+                    writer.write_all(result[2])
+                    output.flush()
+                    os.fsync(output.fileno())
+                    checkpoint.offset = output.tell()
+                checkpoint.done.add(index)
+
+                if default_timer() - saved > self.interval:
+                    checkpoint.save()
+                    saved = default_timer()
+
+            checkpoint.save()
+        finally:
+            if output is not None:
+                output.close()
+
+        return checkpoint.solution_count, checkpoint.canonical_count
+
+    def open_output(self):
+        """Open the output file positioned after the last finished subtree."""
+        checkpoint = self.checkpoint
+        if checkpoint.output is None:
+            return None
+
+        if checkpoint.offset is None:
+            output = open(checkpoint.output, 'wb')
+            solutionfile.SolutionWriter(
+                output, checkpoint.rows, checkpoint.cols,
+                checkpoint.piece_types)
+            checkpoint.offset = output.tell()
+            return output
+
+        output = open(checkpoint.output, 'r+b')
+        output.seek(0, os.SEEK_END)
+        if output.tell() < checkpoint.offset:
+            output.close()
+            raise ValueError(
+                "Output file is shorter than saved in the checkpoint: "
+                "{}".format(checkpoint.output))
+        # drop the solutions of subtrees which were not finished
+        output.truncate(checkpoint.offset)
+        output.seek(checkpoint.offset)
+
+        return output
+
+    def results(self):
+        """Search the remaining subtrees, yields (index, result) pairs.
+
+        Results are (solutions, canonical solutions) counts followed by the
+        found compositions when writing an output file.
+        """
+        checkpoint = self.checkpoint
+        pending = [
+            index for index in range(len(checkpoint.prefixes))
+            if index not in checkpoint.done
+        ]
+        tasks = [
+            (checkpoint.rows, checkpoint.cols, checkpoint.piece_types,
+             checkpoint.options, checkpoint.prefixes[index])
+            for index in pending
+        ]
+        if checkpoint.output is not None:
+            function = composer._find_prefix_compositions
+        else:
+            function = composer._count_prefix_compositions
+
+        if self.workers is None or self.workers < 2:
+            for index, task in zip(pending, tasks):
+                yield index, function(task)
+            return
+
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            # imap keeps the order of tasks, so results match the subtrees
+            for index, result in zip(pending, pool.imap(function, tasks)):
+                yield index, result
+        finally:
+            pool.terminate()
+            pool.join()
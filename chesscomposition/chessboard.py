@@ -2,6 +2,8 @@
 
 from collections import defaultdict
 
+import pieces as pcs
+
 
 class Chessboard(object):
     """Represents chessboard.
@@ -31,15 +33,12 @@ class Chessboard(object):
         # track of this number
         self.threatened_dict = defaultdict(lambda: 0)
         self._blocked_positions = set()
+        # attack tables of the piece types added to the chessboard
+        self._attack_tables = {}
         self._rows = rows
         self._cols = cols
         self._is_square = (rows == cols)
 
-        # number of checked rows in square chessboards
-        # in the top recursive calls - this results in approx. 4x speedup
-        self._opt_rows = (rows+1)/2 if self._is_square else rows
-        self._opt_cols = (cols+1)/2 if self._is_square else cols
-
         self.add_threatened = add_threatened
 
     @property
@@ -50,14 +49,6 @@ class Chessboard(object):
     def cols(self):
         return self._cols
 
-    @property
-    def opt_rows(self):
-        return self._opt_rows
-
-    @property
-    def opt_cols(self):
-        return self._opt_cols
-
     @property
     def is_square(self):
         return self._is_square
@@ -70,6 +61,50 @@ class Chessboard(object):
 
         return self.occupied_positions
 
+    def is_blocked(self, pos):
+        """Check if a position is occupied or threatened.
+
+        This is equivalent to `pos in self.blocked_positions` but does not
+        build the union of occupied and threatened positions.
+        """
+        if pos in self.occupied_positions:
+            return True
+
+        return not self.add_threatened and pos in self.threatened_positions
+
+    def free_count(self):
+        """Get the number of positions which are not blocked."""
+        blocked = len(self.occupied_positions)
+        if not self.add_threatened:
+            # pieces are never placed on threatened positions
+            blocked += len(self.threatened_positions)
+
+        return self._rows * self._cols - blocked
+
+    def attack_table(self, PieceClass):
+        """Get the attack table of a piece type for this chessboard."""
+        table = self._attack_tables.get(PieceClass)
+        if table is None:
+            table = pcs.attack_table(PieceClass, self._rows, self._cols)
+            self._attack_tables[PieceClass] = table
+
+        return table
+
+    def legal_count(self, PieceClass):
+        """Get the number of positions a piece type could be added to."""
+        moves = self.attack_table(PieceClass).moves
+        occupied = self.occupied_positions
+        count = 0
+        for row in range(self._rows):
+            for col in range(self._cols):
+                pos = (row, col)
+                if self.is_blocked(pos):
+                    continue
+                if moves[row * self._cols + col].isdisjoint(occupied):
+                    count += 1
+
+        return count
+
     def add(self, piece, pos):
         """Add a chess piece to a chessboard.
 
@@ -83,8 +118,10 @@ class Chessboard(object):
         if pos in self.threatened_positions and not self.add_threatened:
             return False
 
-        piece.bound_chessboard = self
-        piece.position = pos
+        piece.place(
+            pos, self._rows, self._cols,
+            self.attack_table(piece.__class__).moves[
+                pos[0] * self._cols + pos[1]])
 
         # check if new possible moves don't threaten existing pieces
         if piece.possible_moves.intersection(self.occupied_positions):
@@ -121,6 +158,7 @@ class Chessboard(object):
             if self.threatened_dict[position] == 0:
                 self.threatened_positions.remove(position)
 
+        self.pieces.remove(piece)
         piece.reset()
 
         return True
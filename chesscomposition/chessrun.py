@@ -3,19 +3,24 @@
 
 from __future__ import print_function
 import argparse
+import sys
 
-import piececomposer as composer
-import pieces as pcs
+# The search modules are imported only when a search is run, so argument
+# errors, --help and infeasible problems are answered quickly.
 
-
-PIECE_CLASSES = {
-    'K': pcs.King,
-    'Q': pcs.Queen,
-    'B': pcs.Bishop,
-    'R': pcs.Rook,
-    'N': pcs.Knight
+PIECE_NAMES = {
+    'K': 'King',
+    'Q': 'Queen',
+    'B': 'Bishop',
+    'R': 'Rook',
+    'N': 'Knight'
 }
 
+# same as in PieceComposer
+ENGINES = ('bitboard', 'propagation', 'set', 'stack')
+ORDERINGS = ('static', 'dynamic')
+PRUNES = ('free', 'legal')
+
 
 def setup_args():
     """Set up parse arguments."""
@@ -34,57 +39,504 @@ def setup_args():
         Dimensions are limited to 16x16.
         E.g.
         chessrun.py 3 3 2N 1R
+
+        A search saving checkpoints can be continued after it was killed
+        with chessrun.py --resume CHECKPOINT.
+
+        A search served with --serve HOST:PORT is run by workers started
+        with chessrun.py --worker HOST:PORT, e.g. on other machines.
+
+        Fairy pieces with their own symbols are defined in a JSON file
+        given by --pieces-file, see fairy_pieces.json.
         """
     )
 
-    parser.add_argument('cols', type=int, help='Chessboard columns')
-    parser.add_argument('rows', type=int, help='Chessboard rows')
-    parser.add_argument('pieces', nargs='+', help='List of pieces')
+    parser.add_argument(
+        'cols', type=int, nargs='?', help='Chessboard columns')
+    parser.add_argument('rows', type=int, nargs='?', help='Chessboard rows')
+    parser.add_argument('pieces', nargs='*', help='List of pieces')
+    parser.add_argument(
+        '--pieces-file', metavar='FILE',
+        help='JSON file defining fairy pieces and their symbols')
+    parser.add_argument(
+        '--engine', choices=ENGINES,
+        default='set', help='Chessboard engine used for the search')
+    parser.add_argument(
+        '--prune', choices=PRUNES,
+        help='Cut branches without enough free (or legal) squares left')
+    parser.add_argument(
+        '--ordering', choices=ORDERINGS,
+        default='static',
+        help="Order of placed pieces, 'dynamic' requires the stack engine")
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of worker processes used for the search')
+    parser.add_argument(
+        '--count-only', action='store_true',
+        help='Only count the solutions without storing them')
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='Write every solution to stdout as soon as it is found')
+    parser.add_argument(
+        '--limit', type=int, metavar='N',
+        help='Stop the search after finding N solutions')
+    parser.add_argument(
+        '--timeout', type=float, metavar='SECONDS',
+        help='Stop the search after the given time')
+    parser.add_argument(
+        '--cache', metavar='DIR',
+        help='Directory of stored results checked before searching')
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='Extend cached solutions of one piece less instead of '
+             'searching')
+    parser.add_argument(
+        '--output', metavar='FILE',
+        help='Write the solutions to a file in the binary solution format')
+    parser.add_argument(
+        '--stats', metavar='FILE',
+        help="Write search statistics as JSON, '-' for stdout")
+    parser.add_argument(
+        '--checkpoint', metavar='FILE',
+        help='Periodically save the progress of the search to a file')
+    parser.add_argument(
+        '--checkpoint-interval', type=float, default=60.0,
+        metavar='SECONDS', help='Minimum time between saved checkpoints')
+    parser.add_argument(
+        '--resume', metavar='CHECKPOINT',
+        help='Continue the search saved in a checkpoint file')
+    parser.add_argument(
+        '--serve', metavar='HOST:PORT', type=address,
+        help='Serve parts of the search to workers')
+    parser.add_argument(
+        '--task-budget', type=float, default=10.0, metavar='SECONDS',
+        help='Time after which workers split served tasks')
+    parser.add_argument(
+        '--worker', metavar='HOST:PORT', type=address,
+        help='Search parts of a search served by --serve')
 
     args = parser.parse_args()
 
-    if args.cols < 0 <= 16:
+    args.piece_names = PIECE_NAMES
+    if args.pieces_file is not None:
+        try:
+            args.piece_names = load_pieces(args.pieces_file)
+        except (IOError, ValueError) as error:
+            print("Cannot load pieces: {}".format(error))
+            return False
+
+    if (args.resume is not None or args.checkpoint is not None) and (
+            args.stats is not None or args.cache is not None
+            or args.incremental):
+        print("Checkpointed searches cannot collect statistics or use "
+              "a cache")
+        return False
+
+    if args.resume is not None or args.worker is not None:
+        return args
+    if args.cols is None or args.rows is None or not args.pieces:
+        print("Chessboard dimensions and pieces are required")
+        return False
+
+    if not 0 < args.cols <= 16:
         print("Cols should be a positive integer less than 17")
         return False
-    if args.rows < 0 <= 16:
+    if not 0 < args.rows <= 16:
         print("Rows should be a positive integer less than 17")
         return False
 
-    piece_types = []
-    for part in args.pieces:
+    try:
+        piece_counts = parse_pieces(args.pieces, args.piece_names)
+    except ValueError as error:
+        print(error)
+        return False
+
+    if args.jobs < 1:
+        print("Number of jobs should be a positive integer")
+        return False
+    if args.ordering != 'static' and args.engine != 'stack':
+        print("Ordering {} requires the stack engine".format(args.ordering))
+        return False
+    if args.prune is not None and args.engine in ('stack', 'propagation'):
+        print("Pruning is not supported by the {} engine".format(args.engine))
+        return False
+    if args.stats is not None and args.jobs > 1:
+        print("Statistics cannot be collected with several jobs")
+        return False
+    if args.incremental and args.cache is None:
+        print("Extending solutions requires a cache")
+        return False
+    if args.checkpoint is not None and args.stream:
+        print("Streamed solutions cannot be checkpointed")
+        return False
+    if args.stream and (
+            args.output is not None or args.count_only or args.jobs > 1):
+        print("Streamed solutions cannot be written to a file, only "
+              "counted or found with several jobs")
+        return False
+    if args.serve is not None and (
+            args.stream or args.checkpoint is not None):
+        print("Streamed or checkpointed searches cannot be served")
+        return False
+    if args.limit is not None and args.limit < 1:
+        print("Solution limit should be a positive integer")
+        return False
+    if args.timeout is not None and args.timeout <= 0:
+        print("Timeout should be a positive number of seconds")
+        return False
+    if limited(args) and (
+            args.jobs > 1 or args.cache is not None
+            or args.checkpoint is not None or args.serve is not None):
+        print("Limited searches cannot use several jobs, a cache, "
+              "checkpoints or workers")
+        return False
+
+    args.piece_counts = piece_counts
+
+    return args
+
+
+def load_pieces(path):
+    """Define the fairy pieces of a file.
+
+    Returns piece names by symbol, including the orthodox pieces.
+    """
+    import pieces as pcs
+
+    piece_names = dict(PIECE_NAMES)
+    for item in pcs.load_definitions(path):
+        symbol = item.get('symbol')
+        if not (isinstance(symbol, str) and len(symbol) == 1
+                and symbol.isalpha() and symbol.isupper()):
+            raise ValueError(
+                "Piece symbol should be a capital letter: {!r}".format(symbol))
+        if symbol in piece_names:
+            raise ValueError("Piece symbol {} is used twice".format(symbol))
+        PieceClass, = pcs.define_pieces([item])
+        piece_names[symbol] = PieceClass.NAME
+
+    return piece_names
+
+
+def parse_pieces(parts, piece_names=PIECE_NAMES):
+    """Count pieces of declarations like '2N' by piece name.
+
+    `piece_names` maps piece symbols to names. Raises ValueError for
+    a wrong declaration.
+    """
+    piece_counts = {}
+    for part in parts:
         if not len(part) == 2:
-            print("Only two characters per piece declaration are allowed")
-            return False
+            raise ValueError(
+                "Only two characters per piece declaration are allowed")
         if not part[0].isdigit():
-            print(
+            raise ValueError(
                 "Make sure that number of pieces appears before piece symbol")
-            return False
-        if not part[1] in PIECE_CLASSES:
-            print("Make sure that proper piece symbol is used")
-            return False
+        if not part[1] in piece_names:
+            raise ValueError("Make sure that proper piece symbol is used")
+
+        name = piece_names[part[1]]
+        piece_counts[name] = piece_counts.get(name, 0) + int(part[0])
+
+    return piece_counts
+
+
+def address(value):
+    """Parse a HOST:PORT argument."""
+    host, _, port = value.rpartition(':')
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(
+            "Expected HOST:PORT, got {!r}".format(value))
+
+    return host, int(port)
+
+
+def infeasible(rows, cols, piece_counts):
+    """Check if the pieces obviously cannot be placed on the chessboard.
+
+    `piece_counts` maps piece names to their numbers. Only simple bounds
+    are checked, so False does not mean that there is a solution.
+    """
+    count = piece_counts.get
+    # queens and rooks need a row and a column each
+    lines = count('Queen', 0) + count('Rook', 0)
+    # queens and bishops need a diagonal each
+    diagonals = count('Queen', 0) + count('Bishop', 0)
+    # every 2x2 block holds at most one king
+    king_blocks = ((rows + 1) // 2) * ((cols + 1) // 2)
+
+    return (
+        sum(piece_counts.values()) > rows * cols
+        or lines > min(rows, cols)
+        or diagonals > rows + cols - 1
+        or count('King', 0) > king_blocks
+    )
+
+
+def piece_types(piece_counts):
+    """Get the list of piece classes of counted piece names."""
+    import pieces as pcs
+
+    types = []
+    for name, count in sorted(piece_counts.items()):
+        types.extend([pcs.piece_class(name)] * count)
+
+    return types
+
+
+def limited(args):
+    """Check if the search may stop before it is exhaustive."""
+    return args.limit is not None or args.timeout is not None
+
 
-        count = int(part[0])
-        PieceClass = PIECE_CLASSES[part[1]]
+def search_options(args):
+    """Get PieceComposer keyword arguments selecting the search algorithm."""
+    return {
+        'engine': args.engine,
+        'ordering': args.ordering,
+        'prune': args.prune
+    }
 
-        part_list = [PieceClass] * count
-        piece_types.extend(part_list)
 
-    return (args.rows, args.cols, piece_types)
+def format_composition(composition, piece_names=PIECE_NAMES):
+    """Format a composition as piece symbols with (row, column) positions.
+
+    E.g. 'K:0,2 R:1,0 K:2,2'
+    """
+    symbols = dict((name, symbol) for symbol, name in piece_names.items())
+
+    return " ".join(
+        "{}:{},{}".format(symbols[PieceClass.NAME], row, col)
+        for PieceClass, row, col in sorted(
+            composition, key=lambda placement: placement[1:])
+    )
 
 
 def main():
     """Main function."""
-    arguments = setup_args()
+    args = setup_args()
+
+    if args is False:
+        return
+
+    if args.worker is not None:
+        run_worker(args)
+        return
 
-    if arguments is False:
+    if args.resume is not None or args.checkpoint is not None:
+        run_checkpointed(args)
         return
-    rows, cols, piece_types = arguments
+
+    if args.serve is not None:
+        run_coordinator(args)
+        return
+
+    if (args.cache is None and args.stats is None
+            and infeasible(args.rows, args.cols, args.piece_counts)):
+        run_infeasible(args)
+        return
+
+    import piececomposer as composer
+    import resultstore
+    import searchstats
+
+    args.piece_types = piece_types(args.piece_counts)
+
+    store = None
+    if args.cache is not None:
+        store = resultstore.ResultStore(args.cache)
+
+    stats = None
+    if args.stats is not None:
+        stats = searchstats.SearchStats()
 
     piece_composer = composer.PieceComposer(
-        rows, cols, piece_types
+        args.rows, args.cols, args.piece_types,
+        store=store, stats=stats, time_budget=args.timeout,
+        max_solutions=args.limit, extend_base=args.incremental,
+        **search_options(args)
+    )
+
+    run(args, piece_composer)
+
+    if limited(args):
+        report = sys.stderr if args.stream else sys.stdout
+        if piece_composer.exhaustive:
+            report.write("Search was exhaustive\n")
+        else:
+            report.write("Search stopped early, results are partial\n")
+
+    if stats is not None:
+        if args.stats == '-':
+            print(stats.to_json(indent=2))
+        else:
+            with open(args.stats, 'w') as stats_file:
+                stats_file.write(stats.to_json(indent=2))
+
+
+def run_checkpointed(args):
+    """Run or resume a search saving checkpoints."""
+    import checkpoint
+
+    if args.resume is not None:
+        try:
+            saved = checkpoint.Checkpoint.load(args.resume)
+        except (IOError, ValueError, KeyError) as error:
+            print("Cannot resume the search: {}".format(error))
+            return False
+    else:
+        saved = checkpoint.Checkpoint(
+            args.checkpoint, args.rows, args.cols,
+            piece_types(args.piece_counts),
+            options=search_options(args), count_only=args.count_only,
+            output=args.output
+        )
+
+    try:
+        solution_count, canonical_count = checkpoint.CheckpointedSearch(
+            saved, workers=args.jobs, interval=args.checkpoint_interval
+        ).run()
+    except (IOError, ValueError) as error:
+        print("Search failed: {}".format(error))
+        return False
+
+    if saved.output is not None:
+        print("Written {} solutions".format(solution_count))
+    elif saved.count_only:
+        print("Found {} solutions, {} up to symmetry".format(
+            solution_count, canonical_count
+        ))
+    else:
+        print("Found {} solutions".format(solution_count))
+
+    return True
+
+
+def run_coordinator(args):
+    """Serve a search to workers until it is finished."""
+    import distributed
+
+    types = piece_types(args.piece_counts)
+    coordinator = distributed.Coordinator(
+        args.rows, args.cols, types, options=search_options(args),
+        count_only=args.output is None, budget=args.task_budget
     )
+    try:
+        host, port = coordinator.start(*args.serve)
+    except (IOError, OSError) as error:
+        print("Cannot serve the search: {}".format(error))
+        return False
+    print("Serving {} tasks on {}:{}".format(
+        len(coordinator.tasks), host, port))
+
+    try:
+        solution_count, canonical_count = coordinator.wait()
+    except distributed.TaskFailed as error:
+        print("Search failed: {}".format(error))
+        return False
+    finally:
+        coordinator.stop()
+
+    if args.output is not None:
+        import solutionfile
+
+        print("Written {} solutions".format(solutionfile.write_solutions(
+            args.output, args.rows, args.cols, types,
+            coordinator.found_compositions
+        )))
+    elif args.count_only:
+        print("Found {} solutions, {} up to symmetry".format(
+            solution_count, canonical_count
+        ))
+    else:
+        print("Found {} solutions".format(solution_count))
+
+    return True
+
+
+def run_worker(args):
+    """Search tasks served by a coordinator."""
+    import distributed
+
+    try:
+        num_tasks = distributed.run_worker(*args.worker)
+    except (IOError, OSError, ValueError) as error:
+        print("Worker failed: {}".format(error))
+        return False
+    print("Searched {} tasks".format(num_tasks))
+
+    return True
+
+
+def run_infeasible(args):
+    """Report no solutions of an infeasible problem without a search."""
+    if args.stream:
+        sys.stderr.write("Found 0 solutions\n")
+    elif args.output is not None:
+        import solutionfile
+
+        print("Written {} solutions".format(solutionfile.write_solutions(
+            args.output, args.rows, args.cols,
+            piece_types(args.piece_counts), []
+        )))
+    elif args.count_only:
+        print("Found 0 solutions, 0 up to symmetry")
+    else:
+        print("Found 0 solutions")
+
+    if limited(args):
+        report = sys.stderr if args.stream else sys.stdout
+        report.write("Search was exhaustive\n")
+
+
+def run(args, piece_composer):
+    """Run the composer in the mode selected by arguments."""
+    if args.stream:
+        num_found = 0
+        try:
+            for composition in piece_composer.iter_compositions():
+                num_found += 1
+                sys.stdout.write(
+                    format_composition(composition, args.piece_names) + "\n")
+                sys.stdout.flush()
+        except BrokenPipeError:
+            # the reader has gone, e.g. head, the rest of the output is
+            # discarded so that flushing it at exit does not fail again
+            import os
+
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            sys.exit(1)
+        sys.stderr.write("Found {} solutions\n".format(num_found))
+        return
+
+    if args.output is not None:
+        import solutionfile
+
+        if args.jobs > 1 or piece_composer.store is not None:
+            piece_composer.compute(workers=args.jobs)
+            compositions = piece_composer.found_compositions
+        else:
+            compositions = piece_composer.iter_compositions()
+        print("Written {} solutions".format(solutionfile.write_solutions(
+            args.output, args.rows, args.cols, args.piece_types,
+            compositions
+        )))
+        return
+
+    if args.count_only:
+        solution_count, canonical_count = piece_composer.count(
+            workers=args.jobs)
+        if canonical_count is None:
+            print("Found {} solutions (counted without search, solutions "
+                  "up to symmetry not counted)".format(solution_count))
+        else:
+            print("Found {} solutions, {} up to symmetry".format(
+                solution_count, canonical_count
+            ))
+        return
 
-    piece_composer.compute()
+    piece_composer.compute(workers=args.jobs)
 
     print("Found {} solutions".format(
         len(piece_composer.found_compositions)
@@ -0,0 +1,327 @@
+"""Asyncio server answering composition requests.
+
+A client connects over TCP and sends a request as a single JSON line:
+
+    {"cols": 3, "rows": 3, "pieces": ["2K", "1R"], "count_only": false,
+     "engine": "set", "ordering": "static", "prune": null, "timeout": 10}
+
+Only the dimensions and pieces are required. The server answers with JSON
+lines - the compositions are streamed in chunks as they are found
+
+    {"compositions": ["K:0,0 K:0,2 R:2,1", ...]}
+
+and the last line holds the counts
+
+    {"solutions": 4, "canonical": 1, "exhaustive": true}
+
+or {"error": message}. With "count_only" only the last line is sent.
+
+Searches run in a pool of threads, so the event loop keeps serving other
+clients. Requests for a problem which is being searched share the search,
+a later request first gets everything found so far. When the time budget
+of a request passes, it gets the counts so far with "exhaustive": false,
+or null counts when they are only known at the end of the count.
+A search is cancelled as soon as no request waits for it.
+"""
+
+from __future__ import print_function
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import chessrun
+import piececomposer as composer
+import searchcontrol
+
+
+class SharedSearch(object):
+    """A search shared by the requests of the same problem."""
+
+    def __init__(self, piece_composer, count_only):
+        self.composer = piece_composer
+        self.count_only = count_only
+        # chunks of formatted compositions found so far
+        self.chunks = []
+        # queues of the waiting requests
+        self.listeners = set()
+        # the last message, set when the search is finished
+        self.result = None
+
+    def subscribe(self):
+        queue = asyncio.Queue()
+        for chunk in self.chunks:
+            queue.put_nowait({'compositions': chunk})
+        if self.result is not None:
+            queue.put_nowait(self.result)
+        self.listeners.add(queue)
+
+        return queue
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        for queue in self.listeners:
+            queue.put_nowait({'compositions': chunk})
+
+    def finish(self, result):
+        self.result = result
+        for queue in self.listeners:
+            queue.put_nowait(result)
+
+    def partial_result(self, received):
+        """Get the counts of a request whose time budget passed."""
+        if self.count_only:
+            # a count by dpcount is only known when it is finished
+            if self.composer.counts_by_dp:
+                return {
+                    'solutions': None, 'canonical': None,
+                    'exhaustive': False
+                }
+            return {
+                'solutions': self.composer.solution_count,
+                'canonical': self.composer.canonical_count,
+                'exhaustive': False
+            }
+
+        return {'solutions': received, 'canonical': None, 'exhaustive': False}
+
+    def run(self, publish, chunk_size):
+        """Run the search, called in a thread of the executor."""
+        if self.count_only:
+            self.composer.count()
+            return
+
+        chunk = []
+        for composition in self.composer.iter_compositions():
+            chunk.append(chessrun.format_composition(composition))
+            if len(chunk) >= chunk_size:
+                publish(chunk)
+                chunk = []
+        if chunk:
+            publish(chunk)
+
+
+class CompositionServer(object):
+    """Serves composition requests, searching each problem once at a time."""
+
+    # compositions per streamed message
+    CHUNK_SIZE = 1000
+
+    def __init__(self, workers=4, timeout=60.0):
+        self.executor = ThreadPoolExecutor(workers)
+        # time budget of requests without their own, in seconds
+        self.timeout = timeout
+        # running searches by problem signature
+        self.searches = {}
+        self.started_searches = 0
+
+    def problem(self, request):
+        """Get the signature, PieceComposer arguments and time budget of
+        a request.
+
+        Raises ValueError for a wrong request.
+        """
+        if not isinstance(request, dict):
+            raise ValueError("Request should be a JSON object")
+        try:
+            rows, cols = int(request['rows']), int(request['cols'])
+            pieces = request['pieces']
+        except (KeyError, TypeError) as error:
+            raise ValueError(
+                "Wrong or missing dimensions or pieces: {}".format(error))
+        if not (0 < rows <= 16 and 0 < cols <= 16):
+            raise ValueError("Dimensions should be positive integers "
+                             "less than 17")
+        if isinstance(pieces, str):
+            pieces = pieces.split()
+        piece_counts = chessrun.parse_pieces(pieces)
+        options = {
+            'engine': request.get('engine', 'set'),
+            'ordering': request.get('ordering', 'static'),
+            'prune': request.get('prune')
+        }
+        for name, value in options.items():
+            if value is not None and not isinstance(value, str):
+                raise ValueError("Option {} should be a string".format(name))
+        count_only = bool(request.get('count_only', False))
+        try:
+            timeout = float(request.get('timeout', self.timeout))
+        except (TypeError, ValueError):
+            raise ValueError("Timeout should be a number")
+        if not timeout >= 0:
+            raise ValueError("Timeout should not be negative")
+        signature = (
+            rows, cols, tuple(sorted(piece_counts.items())), count_only,
+            tuple(sorted(options.items())))
+
+        return (signature, (rows, cols, piece_counts, options, count_only),
+                timeout)
+
+    def start_search(self, signature, rows, cols, piece_counts, options,
+                     count_only):
+        loop = asyncio.get_event_loop()
+        piece_composer = composer.PieceComposer(
+            rows, cols, chessrun.piece_types(piece_counts),
+            cancel=searchcontrol.CancelToken(), **options)
+        search = SharedSearch(piece_composer, count_only)
+        self.searches[signature] = search
+        self.started_searches += 1
+
+        def publish(chunk):
+            loop.call_soon_threadsafe(search.publish, chunk)
+
+        def finished(future):
+            if self.searches.get(signature) is search:
+                del self.searches[signature]
+            if future.cancelled() or piece_composer.cancelled:
+                return
+            if future.exception() is not None:
+                search.finish({'error': str(future.exception())})
+                return
+            search.finish({
+                'solutions': piece_composer.solution_count,
+                'canonical': piece_composer.canonical_count,
+                'exhaustive': True
+            })
+
+        loop.run_in_executor(
+            self.executor, search.run, publish, self.CHUNK_SIZE
+        ).add_done_callback(finished)
+
+        return search
+
+    def unsubscribe(self, signature, search, queue):
+        """Remove a request, cancelling the search nobody waits for."""
+        search.listeners.discard(queue)
+        if not search.listeners and search.result is None:
+            search.composer.cancel.cancel()
+            if self.searches.get(signature) is search:
+                del self.searches[signature]
+
+    async def handle(self, reader, writer):
+        """Answer a single request."""
+        loop = asyncio.get_event_loop()
+        search = queue = None
+        try:
+            try:
+                request = json.loads((await reader.readline()).decode('utf-8'))
+                signature, problem, timeout = self.problem(request)
+            except (ValueError, TypeError) as error:
+                await self.send(writer, {'error': str(error)})
+                return
+
+            rows, cols, piece_counts = problem[:3]
+            if chessrun.infeasible(rows, cols, piece_counts):
+                await self.send(writer, {
+                    'solutions': 0, 'canonical': 0, 'exhaustive': True})
+                return
+
+            search = self.searches.get(signature)
+            if search is None:
+                try:
+                    search = self.start_search(signature, *problem)
+                except ValueError as error:
+                    await self.send(writer, {'error': str(error)})
+                    return
+            queue = search.subscribe()
+
+            deadline = loop.time() + timeout
+            received = 0
+            while True:
+                # the deadline holds even when chunks are still queued
+                if loop.time() >= deadline:
+                    await self.send(writer, search.partial_result(received))
+                    return
+                try:
+                    message = await asyncio.wait_for(
+                        queue.get(), max(deadline - loop.time(), 0.001))
+                except asyncio.TimeoutError:
+                    continue
+                await self.send(writer, message)
+                if 'compositions' not in message:
+                    return
+                received += len(message['compositions'])
+        except (ConnectionError, IOError):
+            pass
+        finally:
+            if queue is not None:
+                self.unsubscribe(signature, search, queue)
+            writer.close()
+
+    async def send(self, writer, message):
+        writer.write(json.dumps(message).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start serving, returns the asyncio server."""
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        """Cancel all searches and stop the worker threads."""
+        for search in list(self.searches.values()):
+            search.composer.cancel.cancel()
+        self.executor.shutdown(wait=True)
+
+
+async def request(host, port, message):
+    """Send a request to a server and yield the response messages."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(json.dumps(message).encode('utf-8') + b'\n')
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield json.loads(line.decode('utf-8'))
+    finally:
+        writer.close()
+
+
+async def query(host, port, message):
+    """Send a request and get (compositions, last message) of the response."""
+    compositions = []
+    result = None
+    async for response in request(host, port, message):
+        if 'compositions' in response:
+            compositions.extend(response['compositions'])
+        else:
+            result = response
+
+    return compositions, result
+
+
+async def serve(host, port, workers, timeout):
+    server = CompositionServer(workers=workers, timeout=timeout)
+    asyncio_server = await server.start(host, port)
+    print("Serving on {}:{}".format(
+        *asyncio_server.sockets[0].getsockname()[:2]))
+    try:
+        async with asyncio_server:
+            await asyncio_server.serve_forever()
+    finally:
+        server.close()
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(
+        description="Serve chess piece compositions to clients.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='Number of searches run at the same time')
+    parser.add_argument(
+        '--timeout', type=float, default=60.0, metavar='SECONDS',
+        help='Time budget of requests which do not set their own')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.timeout))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""Module for searching compositions with workers on several machines.
+
+A Coordinator splits the search into subtrees (see PieceComposer.split)
+and serves them as tasks over TCP. Messages are JSON objects, one per
+line. A worker asks for a task
+
+    {"request": "task"}
+
+and gets the problem with the prefix of a subtree, {"wait": seconds} when
+all tasks are taken, or {"done": true} when the search is finished. It
+sends back the result
+
+    {"request": "result", "task": id, "solutions": n, "canonical": n,
+     "compositions": [...], "remaining": [...]}
+
+where compositions are lists of packed placement records (see placement)
+and are left empty when only counting.
+
+The granularity of tasks is adaptive. A worker searches the subtrees one
+level below the prefix of its task one after another. When the task
+takes longer than its time budget, the worker stops after the current
+subtree and returns the prefixes of the subtrees it did not search as
+"remaining", which the coordinator queues as new tasks. Slow parts of the
+search are split again and again, while fast ones are never split.
+
+Every task is leased to a single worker. Tasks of workers which
+disconnect or do not finish them within the lease timeout are given to
+other workers, at most `max_attempts` times in total.
+"""
+
+import json
+import multiprocessing
+import socket
+import socketserver
+import threading
+import time
+from collections import Counter, deque
+from timeit import default_timer
+
+import piececomposer as composer
+import pieces as pcs
+import placement
+import solutionfile
+
+
+class TaskFailed(Exception):
+    """Raised when a task was given to workers too many times."""
+
+
+class Coordinator(object):
+    """Serves subtrees of a search to workers and collects the results."""
+
+    # number of subtrees the search is split into at first
+    MIN_PREFIXES = 64
+
+    # seconds a worker waits before asking again when all tasks are taken
+    WAIT = 0.5
+
+    def __init__(self, rows, cols, piece_types, options=None,
+                 count_only=False, min_prefixes=None, budget=10.0,
+                 lease_timeout=600.0, max_attempts=3):
+        self.rows = rows
+        self.cols = cols
+        self.piece_types = tuple(piece_types)
+        # PieceComposer keyword arguments selecting the search algorithm
+        self.options = dict(options or {})
+        self.count_only = count_only
+        # seconds after which workers return unsearched subtrees, None
+        # to never split tasks
+        self.budget = budget
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.codec = placement.PlacementCodec(rows, cols, piece_types)
+        # fairy pieces are defined by workers
+        self.definitions = pcs.definitions(piece_types)
+
+        # unfinished tasks by id, prefixes of (row, column) positions
+        self.tasks = {}
+        self.pending = deque()
+        # lease expiry times by task id
+        self.leases = {}
+        self.attempts = Counter()
+        self.next_id = 0
+        self.solution_count = 0
+        self.canonical_count = 0
+        # packed compositions
+        self.compositions = set()
+        self.error = None
+        self.condition = threading.Condition()
+        self.server = None
+
+        piece_composer = composer.PieceComposer(
+            rows, cols, piece_types, **self.options)
+        for prefix in piece_composer.split(
+                min_prefixes or self.MIN_PREFIXES):
+            self.add_task(prefix)
+
+    @property
+    def finished(self):
+        return self.error is not None or not self.tasks
+
+    @property
+    def address(self):
+        """Get the (host, port) the coordinator listens on."""
+        return self.server.server_address[:2]
+
+    def add_task(self, prefix):
+        self.tasks[self.next_id] = tuple(tuple(pos) for pos in prefix)
+        self.pending.append(self.next_id)
+        self.next_id += 1
+
+    def retry(self, task_id):
+        """Take a task from its worker and queue it again."""
+        del self.leases[task_id]
+        if self.attempts[task_id] >= self.max_attempts:
+            self.error = TaskFailed(
+                "Task {} failed {} times".format(task_id, self.max_attempts))
+        else:
+            self.pending.append(task_id)
+        self.condition.notify_all()
+
+    def expire_leases(self):
+        now = default_timer()
+        for task_id, expiry in list(self.leases.items()):
+            if expiry < now:
+                self.retry(task_id)
+
+    def handle(self, message, leased):
+        """Answer a message of a worker holding the `leased` task ids."""
+        request = message.get('request')
+        with self.condition:
+            self.expire_leases()
+            if request == 'task':
+                return self.lease(leased)
+            if request == 'result':
+                self.complete(message, leased)
+                return {'ok': True}
+
+        raise ValueError("Unknown request {!r}".format(request))
+
+    def lease(self, leased):
+        if self.finished:
+            return {'done': True}
+        if not self.pending:
+            return {'wait': self.WAIT}
+
+        task_id = self.pending.popleft()
+        self.attempts[task_id] += 1
+        self.leases[task_id] = default_timer() + self.lease_timeout
+        leased.add(task_id)
+
+        return {
+            'task': task_id,
+            'rows': self.rows,
+            'cols': self.cols,
+            'pieces': [PieceClass.NAME for PieceClass in self.piece_types],
+            'definitions': self.definitions,
+            'options': self.options,
+            'count_only': self.count_only,
+            'budget': self.budget,
+            'prefix': [list(pos) for pos in self.tasks[task_id]]
+        }
+
+    def complete(self, message, leased):
+        task_id = message['task']
+        leased.discard(task_id)
+        if task_id not in self.tasks:
+            # the task was given to another worker which finished it first
+            return
+
+        remaining = [
+            tuple(tuple(pos) for pos in prefix)
+            for prefix in message.get('remaining', ())]
+        compositions = [
+            tuple(records) for records in message.get('compositions', ())]
+        self.solution_count += message['solutions']
+        self.canonical_count += message['canonical']
+        self.compositions.update(compositions)
+
+        del self.tasks[task_id]
+        self.leases.pop(task_id, None)
+        if task_id in self.pending:
+            self.pending.remove(task_id)
+        for prefix in remaining:
+            self.add_task(prefix)
+        self.condition.notify_all()
+
+    def release(self, leased):
+        """Queue again unfinished tasks of a disconnected worker."""
+        with self.condition:
+            for task_id in leased:
+                if task_id in self.leases:
+                    self.retry(task_id)
+            leased.clear()
+
+    def start(self, host='127.0.0.1', port=0):
+        """Start serving tasks in a background thread."""
+        self.server = _Server((host, port), _Handler)
+        self.server.coordinator = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return self.address
+
+    def wait(self, timeout=None):
+        """Wait until all tasks are finished.
+
+        Returns a (solutions, canonical solutions) tuple, or None when the
+        timeout passes first. Raises TaskFailed when a task failed.
+        """
+        deadline = None if timeout is None else default_timer() + timeout
+        with self.condition:
+            while not self.finished:
+                if deadline is not None and default_timer() > deadline:
+                    return None
+                self.condition.wait(self.WAIT)
+                self.expire_leases()
+            if self.error is not None:
+                raise self.error
+
+        return self.solution_count, self.canonical_count
+
+    def stop(self):
+        """Stop accepting workers.
+
+        Connected workers are told that the search is done.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def run(self, host='127.0.0.1', port=0):
+        """Serve tasks until the search is finished."""
+        self.start(host, port)
+        try:
+            return self.wait()
+        finally:
+            self.stop()
+
+    @property
+    def found_compositions(self):
+        """Get the found compositions as a set of frozensets."""
+        return set(
+            self.codec.unpack(records) for records in self.compositions)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answers messages of a single worker connection."""
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        leased = set()
+        try:
+            for line in self.rfile:
+                try:
+                    response = coordinator.handle(
+                        json.loads(line.decode('utf-8')), leased)
+                except (ValueError, KeyError, TypeError) as error:
+                    response = {'error': str(error)}
+                self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+                if 'error' in response:
+                    return
+        except (IOError, OSError):
+            pass
+        finally:
+            coordinator.release(leased)
+
+
+class Connection(object):
+    """Connection of a worker to a coordinator."""
+
+    def __init__(self, host, port, timeout=None):
+        self.socket = socket.create_connection((host, port), timeout)
+        self.file = self.socket.makefile('rwb')
+
+    def request(self, message):
+        """Send a message and read the response."""
+        self.file.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise IOError("Coordinator closed the connection")
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise ValueError(response['error'])
+
+        return response
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def solve_task(task, classes=None):
+    """Search the subtrees of a task until its time budget runs out.
+
+    Returns the result message.
+    """
+    pcs.define_pieces(task.get('definitions', ()))
+    if classes is None:
+        classes = solutionfile.piece_classes()
+    rows, cols = task['rows'], task['cols']
+    piece_types = [classes[name] for name in task['pieces']]
+    options = task['options']
+    budget = task['budget']
+    deadline = None if budget is None else default_timer() + budget
+
+    subtrees = composer.PieceComposer(
+        rows, cols, piece_types, prefix=[tuple(pos) for pos in task['prefix']],
+        **options).split(2)
+
+    result = {
+        'request': 'result',
+        'task': task['task'],
+        'solutions': 0,
+        'canonical': 0,
+        'compositions': [],
+        'remaining': []
+    }
+    for index, prefix in enumerate(subtrees):
+        # at least one subtree is searched, so every task makes progress
+        if index and deadline is not None and default_timer() > deadline:
+            result['remaining'] = [
+                [list(pos) for pos in prefix] for prefix in subtrees[index:]]
+            break
+
+        piece_composer = composer.PieceComposer(
+            rows, cols, piece_types, prefix=prefix, **options)
+        if task['count_only']:
+            piece_composer.count()
+        else:
+            compositions = piece_composer.compact_compositions()
+            result['compositions'].extend(
+                compositions.packed(i) for i in range(len(compositions)))
+        result['solutions'] += piece_composer.solution_count
+        result['canonical'] += piece_composer.canonical_count
+
+    return result
+
+
+def run_worker(host, port, classes=None):
+    """Search tasks of a coordinator until the search is finished.
+
+    Returns the number of searched tasks.
+    """
+    connection = Connection(host, port)
+    num_tasks = 0
+    try:
+        while True:
+            try:
+                response = connection.request({'request': 'task'})
+            except (IOError, OSError):
+                # the coordinator exits when the search is finished
+                return num_tasks
+            if response.get('done'):
+                return num_tasks
+            if 'wait' in response:
+                time.sleep(response['wait'])
+                continue
+            connection.request(solve_task(response, classes))
+            num_tasks += 1
+    finally:
+        connection.close()
+
+
+def run_local(coordinator, workers=2):
+    """Run a coordinator with worker processes on this machine.
+
+    Returns the (solutions, canonical solutions) of the search.
+    """
+    host, port = coordinator.start()
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(host, port))
+        for _ in range(workers)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        return coordinator.wait()
+    finally:
+        coordinator.stop()
+        for process in processes:
+            process.join()
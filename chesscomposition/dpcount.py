@@ -0,0 +1,127 @@
+"""Module for counting compositions of short-range pieces.
+
+Kings and knights only attack squares at most two rows away, so the
+compositions can be counted row by row without enumerating them. The
+chessboard is swept along its longer side and every row is a pattern of
+kings and knights which do not attack each other. The number of ways to
+fill the rows so far is kept for every state - the patterns of the last
+two rows and the numbers of kings and knights which remain to be placed.
+The count is exact, but no solutions up to symmetry are counted.
+"""
+
+import pieces as pcs
+
+
+SUPPORTED_TYPES = frozenset([pcs.King, pcs.Knight])
+
+
+def supports(piece_types):
+    """Check if compositions of the pieces can be counted."""
+    return SUPPORTED_TYPES.issuperset(piece_types)
+
+
+def spread(mask, distance, full):
+    """Get columns at the given distance from columns of a mask."""
+    return full & (mask << distance | mask >> distance)
+
+
+def row_patterns(width, allowed_kings, allowed_knights, max_kings,
+                 max_knights):
+    """Get rows of non-attacking kings and knights.
+
+    Kings and knights are placed only on the allowed columns and their
+    numbers are limited. Returns a list of (kings, knights) bitmasks of
+    columns, the first one being the empty row.
+    """
+    patterns = []
+
+    def fill(col, kings, knights, num_kings, num_knights):
+        if col == width:
+            patterns.append((kings, knights))
+            return
+        bit = 1 << col
+        previous = bit >> 1
+        fill(col + 1, kings, knights, num_kings, num_knights)
+        # a king attacks its neighbours in the row
+        if previous & kings:
+            return
+        if (num_kings < max_kings and bit & allowed_kings
+                and not previous & (kings | knights)):
+            fill(col + 1, kings | bit, knights, num_kings + 1, num_knights)
+        if num_knights < max_knights and bit & allowed_knights:
+            fill(col + 1, kings, knights | bit, num_kings, num_knights + 1)
+
+    fill(0, 0, 0, 0, 0)
+
+    return patterns
+
+
+def count_compositions(rows, cols, piece_types, cancel=None):
+    """Count compositions of kings and knights on the chessboard.
+
+    Returns None when the `cancel` token (searchcontrol.CancelToken) is
+    cancelled before the count is finished, it is checked for every state.
+    """
+    if not supports(piece_types):
+        raise ValueError("Only kings and knights can be counted")
+    piece_types = list(piece_types)
+    num_kings = piece_types.count(pcs.King)
+    num_knights = piece_types.count(pcs.Knight)
+    width, length = min(rows, cols), max(rows, cols)
+    full = (1 << width) - 1
+    # a row holds at most every other column of kings, or all knights
+    max_row_pieces = width if num_knights else (width + 1) // 2
+
+    def next_patterns(second_last, last, max_kings, max_knights):
+        """Get patterns which may follow the last two rows."""
+        second_kings, second_knights = second_last
+        last_kings, last_knights = last
+        last_occupied = last_kings | last_knights
+        second_occupied = second_kings | second_knights
+        # columns attacked by pieces of the last two rows
+        attacked = (
+            spread(last_kings, 1, full) | last_kings
+            | spread(last_knights, 2, full)
+            | spread(second_knights, 1, full))
+        # columns from which a piece would attack the last two rows
+        allowed_kings = full & ~(
+            attacked | spread(last_occupied, 1, full) | last_occupied)
+        allowed_knights = full & ~(
+            attacked | spread(last_occupied, 2, full)
+            | spread(second_occupied, 1, full))
+
+        return [
+            (kings, knights, bin(kings).count('1'), bin(knights).count('1'))
+            for kings, knights in row_patterns(
+                width, allowed_kings, allowed_knights, max_kings,
+                max_knights)
+        ]
+
+    # (second last, last) rows -> remaining (kings, knights) -> ways
+    states = {((0, 0), (0, 0)): {(num_kings, num_knights): 1}}
+    for row_index in range(length):
+        # pieces which fit in the rows after this one
+        capacity = (length - row_index - 1) * max_row_pieces
+        next_states = {}
+        for (second_last, last), remaining in states.items():
+            if cancel is not None and cancel.check():
+                return None
+            max_kings = max(kings for kings, _ in remaining)
+            max_knights = max(knights for _, knights in remaining)
+            for kings, knights, row_kings, row_knights in next_patterns(
+                    second_last, last, max_kings, max_knights):
+                ways = None
+                for (left_kings, left_knights), count in remaining.items():
+                    left_kings -= row_kings
+                    left_knights -= row_knights
+                    if (left_kings < 0 or left_knights < 0
+                            or left_kings + left_knights > capacity):
+                        continue
+                    if ways is None:
+                        ways = next_states.setdefault(
+                            (last, (kings, knights)), {})
+                    ways[left_kings, left_knights] = ways.get(
+                        (left_kings, left_knights), 0) + count
+        states = next_states
+
+    return sum(remaining.get((0, 0), 0) for remaining in states.values())
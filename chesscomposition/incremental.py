@@ -0,0 +1,78 @@
+"""Module for extending compositions by one more piece.
+
+Taking a piece off a composition leaves a composition of the other pieces,
+so every composition of a problem with one more piece is an extension of
+a composition of the smaller problem. The new piece is placed on every
+square which is not blocked and from which it attacks no other piece.
+When the pieces already include its type, it is placed only after their
+last square, so every extended composition is found exactly once.
+
+Up to symmetry it is enough to extend the canonical compositions, since
+some image of every extended composition extends a canonical one (see
+PieceComposer.extend).
+"""
+
+import bitboard as bcb
+import pieces as pcs
+
+
+class Extender(object):
+    """Extends compositions on a chessboard by a piece of a given type."""
+
+    def __init__(self, rows, cols, PieceClass):
+        self.rows = rows
+        self.cols = cols
+        self.PieceClass = PieceClass
+        self.full = (1 << (rows * cols)) - 1
+        # squares from which the new piece attacks a square
+        self.reverse = bcb.reverse_masks(
+            pcs.attack_table(PieceClass, rows, cols).masks)
+        self._masks = {}
+
+    def attack_masks(self, PieceClass):
+        masks = self._masks.get(PieceClass)
+        if masks is None:
+            masks = self._masks[PieceClass] = pcs.attack_table(
+                PieceClass, self.rows, self.cols).masks
+
+        return masks
+
+    def squares(self, composition, ordered=True):
+        """Get squares on which the new piece extends a composition.
+
+        Unless `ordered` is False, pieces of the same type are taken to
+        be placed in increasing square order.
+        """
+        cols = self.cols
+        reverse = self.reverse
+        blocked = 0
+        # squares on which the new piece keeps the square order of its type
+        after_last = self.full
+        for PieceClass, row, col in composition:
+            square = row * cols + col
+            blocked |= (1 << square | self.attack_masks(PieceClass)[square]
+                        | reverse[square])
+            if ordered and PieceClass is self.PieceClass:
+                after_last &= ~((2 << square) - 1)
+
+        free = after_last & ~blocked
+        squares = []
+        while free:
+            low_bit = free & -free
+            free ^= low_bit
+            squares.append(low_bit.bit_length() - 1)
+
+        return squares
+
+    def extend(self, compositions):
+        """Generate all extensions of compositions."""
+        PieceClass = self.PieceClass
+        for composition in compositions:
+            for square in self.squares(composition):
+                yield composition.union([
+                    (PieceClass,) + divmod(square, self.cols)])
+
+
+def extend_compositions(compositions, rows, cols, PieceClass):
+    """Generate compositions extended by a piece of the given type."""
+    return Extender(rows, cols, PieceClass).extend(compositions)
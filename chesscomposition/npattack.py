@@ -0,0 +1,192 @@
+"""Module for validating compositions in batches with NumPy.
+
+Every piece type and chessboard size has a (squares x squares) boolean
+attack matrix - element [a, b] is True when the piece on square a attacks
+square b. Squares are numbered row * cols + column as everywhere else.
+
+A batch of compositions of the same pieces is an (compositions x pieces)
+array of squares, its columns sorted by piece type name the same way as
+records of solution files. Validating the batch takes a couple of array
+operations per pair of columns instead of a Python call per piece.
+
+NumPy is optional, the functions raise ImportError without it.
+"""
+
+import threading
+from collections import namedtuple
+
+import solutionfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+Validation = namedtuple(
+    'Validation', ('compositions', 'invalid', 'duplicates'))
+
+_matrices = {}
+_matrices_lock = threading.Lock()
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for batch validation")
+
+
+def build_attack_matrix(PieceClass, rows, cols):
+    """Build the attack matrix of a piece type from its relative moves."""
+    require_numpy()
+    squares = np.arange(rows * cols)
+    square_rows, square_cols = np.divmod(squares, cols)
+    matrix = np.zeros((rows * cols, rows * cols), dtype=bool)
+
+    for rel_y, rel_x, scale in PieceClass.RELATIVE_MOVES:
+        for factor in range(1, max(rows, cols) if scale else 2):
+            target_rows = square_rows + rel_y * factor
+            target_cols = square_cols + rel_x * factor
+            inside = ((0 <= target_rows) & (target_rows < rows)
+                      & (0 <= target_cols) & (target_cols < cols))
+            matrix[squares[inside],
+                   target_rows[inside] * cols + target_cols[inside]] = True
+
+    return matrix
+
+
+def attack_matrix(PieceClass, rows, cols):
+    """Get the cached attack matrix of a piece type.
+
+    The returned array is shared and set read-only.
+    """
+    key = (PieceClass, rows, cols)
+    with _matrices_lock:
+        matrix = _matrices.get(key)
+    if matrix is None:
+        matrix = build_attack_matrix(PieceClass, rows, cols)
+        matrix.flags.writeable = False
+        with _matrices_lock:
+            matrix = _matrices.setdefault(key, matrix)
+
+    return matrix
+
+
+def column_types(piece_types):
+    """Get piece types of batch columns, sorted by type name."""
+    return sorted(piece_types, key=lambda PieceClass: PieceClass.NAME)
+
+
+def validate(squares, piece_types, rows, cols):
+    """Check a batch of compositions.
+
+    `squares` is an (compositions x pieces) array of squares whose columns
+    hold the pieces in the order of column_types(piece_types). Returns
+    a boolean array, True for valid compositions - all pieces are on the
+    chessboard, on different squares and none attacks another.
+    """
+    require_numpy()
+    squares = np.asarray(squares, dtype=np.intp)
+    types = column_types(piece_types)
+    if squares.ndim != 2 or squares.shape[1] != len(types):
+        raise ValueError("Expected an array with {} columns".format(
+            len(types)))
+
+    valid = np.all((0 <= squares) & (squares < rows * cols), axis=1)
+    if not squares.shape[1]:
+        return valid
+    # invalid compositions are checked on square 0, their result is ignored
+    squares = np.where(valid[:, np.newaxis], squares, 0)
+
+    ordered = np.sort(squares, axis=1)
+    valid &= np.all(ordered[:, 1:] != ordered[:, :-1], axis=1)
+
+    for column, PieceClass in enumerate(types):
+        matrix = attack_matrix(PieceClass, rows, cols)
+        for other in range(len(types)):
+            if other != column:
+                valid &= ~matrix[squares[:, column], squares[:, other]]
+
+    return valid
+
+
+def composition_array(compositions, piece_types, cols):
+    """Convert compositions to an array for validate()."""
+    require_numpy()
+    types = column_types(piece_types)
+    squares = np.zeros((len(compositions), len(types)), dtype=np.intp)
+    for index, composition in enumerate(compositions):
+        placements = sorted(
+            (PieceClass.NAME, row * cols + col)
+            for PieceClass, row, col in composition)
+        if [name for name, _ in placements] != [
+                PieceClass.NAME for PieceClass in types]:
+            # square -1 is outside of the chessboard, so compositions of
+            # other pieces are invalid
+            squares[index] = -1
+            continue
+        squares[index] = [square for _, square in placements]
+
+    return squares
+
+
+def validate_compositions(compositions, rows, cols, piece_types):
+    """Check compositions, e.g. found by an engine.
+
+    Returns a Validation with the number of compositions, invalid ones and
+    duplicates. Compositions with wrong pieces count as invalid.
+    """
+    compositions = list(compositions)
+    squares = composition_array(compositions, piece_types, cols)
+    valid = validate(squares, piece_types, rows, cols)
+
+    return Validation(
+        len(compositions), int(np.count_nonzero(~valid)),
+        count_duplicates(squares))
+
+
+def count_duplicates(squares):
+    """Count rows of an array which are equal to a preceding row."""
+    if not len(squares):
+        return 0
+
+    return len(squares) - len(np.unique(squares, axis=0))
+
+
+def validate_solution_file(path, piece_types=None):
+    """Check all compositions of a solution file.
+
+    The records are read through a memory map without decoding them to
+    frozensets. The pieces are taken from the first record unless
+    `piece_types` are given. Returns a Validation.
+    """
+    require_numpy()
+    with solutionfile.MappedSolutionReader(path) as reader:
+        header = reader.header
+        records = np.frombuffer(
+            reader.data, dtype=np.uint8,
+            count=len(reader) * reader.record_size, offset=header.size
+        ).reshape(len(reader), reader.record_size)
+        type_ids = records[:, 0::2].astype(np.intp)
+        squares = records[:, 1::2].astype(np.intp)
+        types = reader.types
+        # the arrays are copied, the map can be closed
+        del records
+
+    if piece_types is None:
+        if not len(type_ids):
+            return Validation(0, 0, 0)
+        piece_types = [types[type_id] for type_id in type_ids[0]]
+    expected_ids = np.array(
+        [types.index(PieceClass) if PieceClass in types else -1
+         for PieceClass in column_types(piece_types)],
+        dtype=np.intp).reshape(1, -1)
+    if expected_ids.shape[1] != header.pieces:
+        raise ValueError("Solution file has {} pieces per record".format(
+            header.pieces))
+
+    valid = np.all(type_ids == expected_ids, axis=1)
+    valid &= validate(squares, piece_types, header.rows, header.cols)
+
+    return Validation(
+        len(squares), int(np.count_nonzero(~valid)),
+        count_duplicates(squares[valid]))
@@ -1,3 +1,105 @@
+"""Module containing chess pieces and their precomputed attack tables.
+
+Besides the orthodox pieces, fairy pieces can be defined at runtime by
+their leaps and rides, see define_piece(). Like all pieces, they are
+searched with attack tables computed once per chessboard size, so they
+are as fast as the orthodox ones.
+"""
+
+import copyreg
+import json
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+
+# Attack table of a piece type on a chessboard of given dimensions.
+# Both tuples are indexed by the square number (row * cols + column) of
+# the attacking piece; `moves` holds frozensets of threatened (row, column)
+# positions and `masks` the same positions as integer bitmasks.
+AttackTable = namedtuple('AttackTable', ('moves', 'masks'))
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+
+
+class AttackTableCache(object):
+    """Bounded LRU cache of attack tables shared by all pieces.
+
+    Tables are keyed by the piece class and the chessboard dimensions and
+    are built for all squares at once on the first lookup. The tables are
+    immutable, so a single table is shared by every piece and chessboard
+    of the same type and size. Chessboards keep the tables of their piece
+    types, so the hits count reuse by chessboards and searches rather than
+    placements. When the cache holds more than `maxsize` tables, the least
+    recently used one is evicted.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, PieceClass, rows, cols):
+        """Get the attack table of a piece type, building it if needed."""
+        key = (PieceClass, rows, cols)
+        with self._lock:
+            table = self._tables.pop(key, None)
+            if table is not None:
+                self.hits += 1
+                self._tables[key] = table
+                return table
+            self.misses += 1
+
+        table = self.build(PieceClass, rows, cols)
+
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last=False)
+
+        return table
+
+    @staticmethod
+    def build(PieceClass, rows, cols):
+        """Compute the attack table of a piece type for all squares."""
+        moves = []
+        masks = []
+        for row in range(rows):
+            for col in range(cols):
+                positions = frozenset(PieceClass.compute_possible_moves(
+                    (row, col), rows, cols))
+                mask = 0
+                for y, x in positions:
+                    mask |= 1 << (y * cols + x)
+                moves.append(positions)
+                masks.append(mask)
+
+        return AttackTable(tuple(moves), tuple(masks))
+
+    def info(self):
+        """Report cache statistics."""
+        with self._lock:
+            return CacheInfo(
+                self.hits, self.misses, self.maxsize, len(self._tables))
+
+    def clear(self):
+        """Drop all cached tables and reset the statistics."""
+        with self._lock:
+            self._tables.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+attack_tables = AttackTableCache()
+
+
+def attack_table(PieceClass, rows, cols):
+    """Get the shared attack table of a piece type for given dimensions."""
+    return attack_tables.get(PieceClass, rows, cols)
+
+
 class Piece(object):
     """Class for a chessboard piece
 
@@ -21,11 +123,15 @@ class Piece(object):
 
     RELATIVE_MOVES = (0, 0, False)
 
+    # pieces are created for every search, so they have no __dict__ and
+    # keep the chessboard dimensions instead of a reference to the board
+    __slots__ = ('position', 'dimensions', 'sort_order', '_possible_moves')
+
     def __init__(self, sort_order=None):
         # stored absolute possible moves in relation
         # to some specific chessboard
         self._possible_moves = None
-        self.bound_chessboard = None
+        self.dimensions = None
         self.position = None
 
         # this governs the priority of the piece when trying different
@@ -33,25 +139,39 @@ class Piece(object):
         # more moves available should be put first
         self.sort_order = sort_order
 
+    def place(self, pos, rows, cols, moves=None):
+        """Put a piece on a position of a chessboard of given dimensions
+
+        A chessboard passes the `moves` of the position from the attack
+        table it holds, so they are not looked up for every placement.
+        """
+        self.dimensions = (rows, cols)
+        self.position = pos
+        self._possible_moves = moves
+
     def reset(self):
         """Equivalent of taking a piece off a chessboard"""
-        self.bound_chessboard = None
+        self.dimensions = None
         self.position = None
         self._possible_moves = None
 
     @property
     def possible_moves(self):
-        """Lazily evaluate and cache possible moves of a piece."""
-        if self.bound_chessboard is None or self.position is None:
+        """Lazily look up possible moves of a piece.
+
+        Unless the chessboard passed them when placing the piece, the moves
+        are taken from the shared attack table. The returned frozenset must
+        not be modified.
+        """
+        if self.dimensions is None or self.position is None:
             return None
         if self._possible_moves is not None:
             return self._possible_moves
 
-        self._possible_moves = self.compute_possible_moves(
-            self.position,
-            self.bound_chessboard.rows,
-            self.bound_chessboard.cols
-        )
+        row, col = self.position
+        rows, cols = self.dimensions
+        table = attack_table(self.__class__, rows, cols)
+        self._possible_moves = table.moves[row * cols + col]
 
         return self._possible_moves
 
@@ -92,6 +212,8 @@ class Bishop(Piece):
 
     NAME = "Bishop"
 
+    __slots__ = ()
+
     RELATIVE_MOVES = (
         (-1, -1, True), (-1, 1, True),
         (1, -1, True), (1, 1, True)
@@ -103,6 +225,8 @@ class Rook(Piece):
 
     NAME = "Rook"
 
+    __slots__ = ()
+
     RELATIVE_MOVES = (
         (0, -1, True), (-1, 0, True),
         (0, 1, True), (1, 0, True)
@@ -114,6 +238,8 @@ class Queen(Piece):
 
     NAME = "Queen"
 
+    __slots__ = ()
+
     RELATIVE_MOVES = Bishop.RELATIVE_MOVES + Rook.RELATIVE_MOVES
 
 
@@ -122,6 +248,8 @@ class Knight(Piece):
 
     NAME = "Knight"
 
+    __slots__ = ()
+
     RELATIVE_MOVES = (
         (-1, -2, False), (-2, -1, False),
         (-2, 1, False), (-1, 2, False),
@@ -135,8 +263,180 @@ class King(Piece):
 
     NAME = "King"
 
+    __slots__ = ()
+
     RELATIVE_MOVES = (
         (-1, -1, False), (-1, 0, False), (-1, 1, False),
         (0, -1, False), (0, 1, False),
         (1, -1, False), (1, 0, False), (1, 1, False)
     )
+
+
+ORTHODOX_PIECES = (Bishop, Rook, Queen, Knight, King)
+
+# pieces defined by define_piece(), by name
+custom_pieces = {}
+
+# names are stored as ASCII in solution files
+NAME_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9_]{0,31}$')
+
+
+class CustomPieceType(type):
+    """Type of pieces created by define_piece().
+
+    The piece types are pickled as their definitions, so they can be
+    passed to worker processes which did not define them.
+    """
+
+
+def _reduce_custom_piece(PieceClass):
+    return define_piece, (PieceClass.NAME, PieceClass.LEAPS, PieceClass.RIDES)
+
+
+copyreg.pickle(CustomPieceType, _reduce_custom_piece)
+
+
+def symmetric_moves(vectors):
+    """Get all rotations and reflections of (y, x) move vectors."""
+    moves = set()
+    for y, x in vectors:
+        for first, second in ((y, x), (x, y)):
+            for sign_y in (1, -1):
+                for sign_x in (1, -1):
+                    moves.add((first * sign_y, second * sign_x))
+
+    return sorted(moves)
+
+
+def normalise_vectors(vectors):
+    """Check move vectors and get them as a sorted tuple of pairs.
+
+    Vectors are taken with all their rotations and reflections, so every
+    vector is normalised to the one with 0 <= y <= x.
+    """
+    normalised = set()
+    for vector in vectors:
+        try:
+            y, x = vector
+        except (TypeError, ValueError):
+            raise ValueError("Move {!r} is not a (y, x) pair".format(vector))
+        if not all(isinstance(value, int) and not isinstance(value, bool)
+                   for value in (y, x)):
+            raise ValueError("Move {!r} is not a pair of integers".format(
+                vector))
+        if y == x == 0:
+            raise ValueError("Null move is not allowed")
+        normalised.add(tuple(sorted((abs(y), abs(x)))))
+
+    return tuple(sorted(normalised))
+
+
+def define_piece(name, leaps=(), rides=()):
+    """Create a piece type moving by given leaps and rides.
+
+    Leaps are (y, x) vectors the piece jumps by, rides are vectors along
+    which it moves any number of times, like a rook along (0, 1). All
+    rotations and reflections of the vectors are included, e.g. leaps
+    [(1, 2)] define a knight, so the chessboard symmetries hold for every
+    piece. Defining a piece of the same name and moves again returns the
+    existing type.
+    """
+    if not isinstance(name, str) or not NAME_PATTERN.match(name):
+        raise ValueError("Wrong piece name: {!r}".format(name))
+    if name in [PieceClass.NAME for PieceClass in ORTHODOX_PIECES]:
+        raise ValueError("Piece {} is already defined".format(name))
+    leaps = normalise_vectors(leaps)
+    rides = normalise_vectors(rides)
+    if not leaps and not rides:
+        raise ValueError("Piece {} has no moves".format(name))
+
+    PieceClass = custom_pieces.get(name)
+    if PieceClass is not None:
+        if (PieceClass.LEAPS, PieceClass.RIDES) != (leaps, rides):
+            raise ValueError(
+                "Piece {} is already defined with other moves".format(name))
+        return PieceClass
+
+    PieceClass = custom_pieces[name] = CustomPieceType(name, (Piece,), {
+        '__doc__': "Represents {} piece.".format(name),
+        '__slots__': (),
+        'NAME': name,
+        'LEAPS': leaps,
+        'RIDES': rides,
+        'RELATIVE_MOVES': tuple(
+            [(y, x, False) for y, x in symmetric_moves(leaps)]
+            + [(y, x, True) for y, x in symmetric_moves(rides)])
+    })
+
+    return PieceClass
+
+
+def definition(PieceClass):
+    """Get the define_piece() arguments of a custom piece type as a dict.
+
+    Returns None for orthodox pieces.
+    """
+    if not isinstance(PieceClass, CustomPieceType):
+        return None
+
+    return {
+        'name': PieceClass.NAME,
+        'leaps': [list(vector) for vector in PieceClass.LEAPS],
+        'rides': [list(vector) for vector in PieceClass.RIDES]
+    }
+
+
+def definitions(piece_types):
+    """Get definition() dicts of the custom types among piece types."""
+    return [
+        definition(PieceClass)
+        for PieceClass in sorted(
+            set(piece_types), key=lambda PieceClass: PieceClass.NAME)
+        if isinstance(PieceClass, CustomPieceType)
+    ]
+
+
+def define_pieces(definitions):
+    """Create piece types of definition() dicts, returns them in a list."""
+    try:
+        return [
+            define_piece(
+                item['name'], item.get('leaps', ()), item.get('rides', ()))
+            for item in definitions
+        ]
+    except (KeyError, TypeError, AttributeError) as error:
+        raise ValueError("Wrong piece definition: {}".format(error))
+
+
+def load_definitions(path):
+    """Read piece definitions from a JSON file.
+
+    The file holds a list of objects with a name, leaps and rides, e.g.
+
+        [{"name": "Camel", "symbol": "C", "leaps": [[1, 3]]},
+         {"name": "Nightrider", "symbol": "H", "rides": [[1, 2]]}]
+
+    Other keys, like the symbol used by chessrun, are kept as they are.
+    Returns the list of objects.
+    """
+    with open(path) as definitions_file:
+        try:
+            definitions = json.load(definitions_file)
+        except ValueError:
+            raise ValueError("Not a piece definitions file: {}".format(path))
+    if not isinstance(definitions, list) or not all(
+            isinstance(item, dict) for item in definitions):
+        raise ValueError("Not a piece definitions file: {}".format(path))
+
+    return definitions
+
+
+def piece_class(name):
+    """Get an orthodox or defined piece type by its name."""
+    for PieceClass in ORTHODOX_PIECES:
+        if PieceClass.NAME == name:
+            return PieceClass
+    try:
+        return custom_pieces[name]
+    except KeyError:
+        raise ValueError("Unknown piece: {}".format(name))
@@ -0,0 +1,127 @@
+"""Module for storing compositions as packed placement records.
+
+A composition is usually a frozenset of (PieceClass, row, column) tuples,
+which takes over a kilobyte for a handful of pieces. A placement record
+packs the same information into one small int:
+
+    type_id << 8 | square
+
+where type_id is the index of the piece name among the sorted names of
+the piece types, as in solution files, and square is row * cols + column.
+A packed composition is the sorted tuple of its records, so it is
+hashable and equal compositions are packed the same way.
+
+CompositionArray keeps many packed compositions of the same pieces in
+a single flat array of unsigned shorts, two bytes per piece.
+"""
+
+from array import array
+
+
+# bits of a record holding the square
+SQUARE_BITS = 8
+SQUARE_MASK = (1 << SQUARE_BITS) - 1
+
+
+class PlacementCodec(object):
+    """Converts compositions of given pieces to and from packed records."""
+
+    def __init__(self, rows, cols, piece_types):
+        if rows * cols > SQUARE_MASK + 1:
+            raise ValueError("Chessboard has too many squares")
+        self.rows = rows
+        self.cols = cols
+        self.num_pieces = len(piece_types)
+        names = sorted(set(PieceClass.NAME for PieceClass in piece_types))
+        classes = dict(
+            (PieceClass.NAME, PieceClass) for PieceClass in piece_types)
+        self.types = tuple(classes[name] for name in names)
+        self.type_ids = dict(
+            (PieceClass, type_id)
+            for type_id, PieceClass in enumerate(self.types))
+
+    def record(self, PieceClass, row, col):
+        """Pack a single placement."""
+        return (self.type_ids[PieceClass] << SQUARE_BITS
+                | row * self.cols + col)
+
+    def placement(self, record):
+        """Unpack a single placement to a (PieceClass, row, col) tuple."""
+        return ((self.types[record >> SQUARE_BITS],)
+                + divmod(record & SQUARE_MASK, self.cols))
+
+    def pack(self, composition):
+        """Pack a composition to a sorted tuple of records."""
+        return tuple(sorted(
+            self.record(PieceClass, row, col)
+            for PieceClass, row, col in composition))
+
+    def unpack(self, records):
+        """Unpack records to a frozenset composition."""
+        return frozenset(self.placement(record) for record in records)
+
+
+class CompositionArray(object):
+    """Compact sequence of compositions of the same pieces.
+
+    Compositions are appended in the frozenset form or as packed tuples
+    and read back as frozensets, or packed with packed().
+    """
+
+    def __init__(self, codec, compositions=()):
+        self.codec = codec
+        self.records = array('H')
+        self.count = 0
+        self.extend(compositions)
+
+    def append(self, composition):
+        self.append_packed(self.codec.pack(composition))
+
+    def append_packed(self, records):
+        if len(records) != self.codec.num_pieces:
+            raise ValueError("Expected {} pieces, got {}".format(
+                self.codec.num_pieces, len(records)))
+        self.records.extend(records)
+        self.count += 1
+
+    def extend(self, compositions):
+        for composition in compositions:
+            self.append(composition)
+
+    def __len__(self):
+        return self.count
+
+    def packed(self, index):
+        """Get a composition as a packed tuple."""
+        if not 0 <= index < len(self):
+            raise IndexError("Composition index out of range")
+        size = self.codec.num_pieces
+        return tuple(self.records[index * size:(index + 1) * size])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return self.codec.unpack(self.packed(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self):
+        """Size of the stored records in bytes."""
+        return len(self.records) * self.records.itemsize
+
+
+def pack_compositions(compositions, rows, cols, piece_types):
+    """Get a set of packed compositions from frozenset compositions."""
+    codec = PlacementCodec(rows, cols, piece_types)
+
+    return set(codec.pack(composition) for composition in compositions)
+
+
+def unpack_compositions(packed, rows, cols, piece_types):
+    """Get a set of frozenset compositions from packed compositions."""
+    codec = PlacementCodec(rows, cols, piece_types)
+
+    return set(codec.unpack(records) for records in packed)
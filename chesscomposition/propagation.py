@@ -0,0 +1,342 @@
+"""Module containing a constraint propagation composition search engine.
+
+The placement is treated as a constraint problem. Every piece type has a
+domain - the bitmask of squares a piece of the type may still be placed
+on. Placing a piece removes from every domain the squares in conflict
+with it: its own square, the squares it attacks and the squares from
+which a piece of the other type would attack it. The conflicts of every
+pair of types are precomputed for all squares, so they form the conflict
+graph of the placements.
+
+Pieces whose attacks cover whole rows, columns or diagonals (rooks,
+queens, bishops and fairy riders like them) attack every other piece on
+those lines, so every line holds at most one of them. The search checks
+that enough lines still cross the domains of these pieces, which cuts
+large empty regions of big chessboards at once.
+"""
+
+import bitboard as bcb
+import pieces as pcs
+import searchcontrol
+
+
+def line_families(rows, cols):
+    """Get the rows, columns, diagonals and anti-diagonals as bitmasks.
+
+    Returns a list of families, every family is a list of its lines.
+    """
+    keys = (
+        lambda row, col: row,
+        lambda row, col: col,
+        lambda row, col: row - col,
+        lambda row, col: row + col
+    )
+    families = []
+    for key in keys:
+        lines = {}
+        for square in range(rows * cols):
+            line = key(*divmod(square, cols))
+            lines[line] = lines.get(line, 0) | 1 << square
+        families.append([lines[line] for line in sorted(lines)])
+
+    return families
+
+
+def fold_shifts(length, step):
+    """Get shifts which OR `length` squares `step` apart into the first.
+
+    ORing a bitmask with itself shifted right by every shift in turn
+    leaves on the first square of a line whether any of its squares is
+    set.
+    """
+    shifts = []
+    window = 1
+    while window < length:
+        size = min(window, length - window)
+        shifts.append(size * step)
+        window += size
+
+    return shifts
+
+
+def rides(masks, lines):
+    """Check if a piece attacks every other square of its lines."""
+    for line in lines:
+        square_bits = line
+        while square_bits:
+            low_bit = square_bits & -square_bits
+            square_bits ^= low_bit
+            if line & ~(low_bit | masks[low_bit.bit_length() - 1]):
+                return False
+
+    return True
+
+
+class PropagationSearch(object):
+    """Searches piece placements by propagating the domains of piece types.
+
+    It has the interface of stacksearch.StackSearch. Every depth places
+    a piece of the remaining type with the fewest squares in its domain,
+    except the first piece, which keeps the first type because the
+    chessboard symmetries are reduced by restricting it to `top_squares`.
+    The type placed at every depth is in self.depth_types as an index to
+    self.classes. Identical pieces are placed in increasing square order.
+
+    A subtree is pruned as soon as a type has fewer squares in its domain
+    than pieces left to place, or when fewer lines cross the domains of
+    the pieces riding the lines of a family than such pieces remain.
+
+    All state is kept in lists indexed by depth which are allocated once:
+
+        domains - domains of all types before the piece is placed
+        candidates - bitmask of squares still to be tried at the depth
+        squares - square number (row * cols + column) of the placed piece
+    """
+
+    def __init__(self, rows, cols, piece_types, top_squares=None, prefix=()):
+        self.rows = rows
+        self.cols = cols
+        self.piece_types = tuple(piece_types)
+        self.full = (1 << (rows * cols)) - 1
+
+        num_pieces = len(self.piece_types)
+        # distinct piece types in the order of their first placement
+        self.classes = []
+        for PieceClass in self.piece_types:
+            if PieceClass not in self.classes:
+                self.classes.append(PieceClass)
+        self.depth_types = [
+            self.classes.index(PieceClass) for PieceClass in self.piece_types]
+        self.type_counts = [
+            self.piece_types.count(PieceClass) for PieceClass in self.classes]
+
+        type_masks = [
+            pcs.attack_table(PieceClass, rows, cols).masks
+            for PieceClass in self.classes
+        ]
+        type_reverse_masks = [bcb.reverse_masks(masks) for masks in type_masks]
+        # squares removed from the domain of a type (second index) by
+        # a piece of a type (first index) placed on a square (third index),
+        # including the squares before it for pieces of the same type
+        self.conflicts = [
+            [
+                [
+                    (1 << square | masks[square] | reverse_masks[square]
+                     | ((2 << square) - 1 if other is placed else 0))
+                    for square in range(rows * cols)
+                ]
+                for other, reverse_masks in enumerate(type_reverse_masks)
+            ]
+            for placed, masks in enumerate(type_masks)
+        ]
+        # rows and columns are counted by folding their squares onto the
+        # first column and row, other lines one by one
+        folds = [
+            (fold_shifts(cols, 1),
+             sum(1 << row * cols for row in range(rows))),
+            (fold_shifts(rows, cols), (1 << cols) - 1),
+            (None, None),
+            (None, None)
+        ]
+        # (riding type indices, lines, fold shifts, first squares) of the
+        # families some types ride
+        self.families = []
+        for lines, (shifts, first) in zip(line_families(rows, cols), folds):
+            riders = [
+                type_index
+                for type_index, masks in enumerate(type_masks)
+                if rides(masks, lines)
+            ]
+            if riders:
+                self.families.append((riders, lines, shifts, first))
+
+        # candidate squares allowed at a depth regardless of the chessboard
+        self.allowed = [self.full] * num_pieces
+        if num_pieces and top_squares is not None:
+            self.allowed[0] = 0
+            for square in top_squares:
+                self.allowed[0] |= 1 << square
+        for depth, square in enumerate(prefix[:num_pieces]):
+            self.allowed[depth] = 1 << square
+
+        self.domains = [[0] * len(self.classes) for _ in range(num_pieces)]
+        self.candidates = [0] * num_pieces
+        self.squares = [0] * num_pieces
+
+        self.reset()
+
+    def reset(self, depth_limit=None):
+        """Start the search from the empty chessboard.
+
+        With `depth_limit` the search stops after placing that many pieces.
+        """
+        self.limit = len(self.piece_types)
+        if depth_limit is not None:
+            self.limit = min(depth_limit, self.limit)
+        self.depth = 0
+        self.done = False
+        self.at_leaf = False
+        # number of placed pieces
+        self.nodes = 0
+        self.remaining = list(self.type_counts)
+        if self.limit:
+            self.domains[0][:] = [self.full] * len(self.classes)
+            self.choose(0)
+
+    def choose(self, depth):
+        """Choose the piece type placed at a depth and its candidates.
+
+        The candidates are left empty when the domains show that the
+        remaining pieces can not be placed.
+        """
+        domain = self.domains[depth]
+        remaining = self.remaining
+
+        chosen = None
+        chosen_squares = 0
+        fewest = None
+        for type_index in range(len(remaining)):
+            if not remaining[type_index]:
+                continue
+            squares = domain[type_index]
+            count = bcb.popcount(squares)
+            if count < remaining[type_index]:
+                # no placement of the remaining pieces exists
+                chosen, chosen_squares = type_index, 0
+                break
+            if depth == 0 and type_index != 0:
+                continue
+            if fewest is None or count < fewest:
+                chosen, chosen_squares, fewest = type_index, squares, count
+        else:
+            for riders, lines, shifts, first in self.families:
+                needed = 0
+                union = 0
+                for type_index in riders:
+                    needed += remaining[type_index]
+                    union |= domain[type_index]
+                if needed < 2:
+                    # a single piece fits if its domain is not empty
+                    continue
+                if shifts is None:
+                    crossing = 0
+                    for line in lines:
+                        if line & union:
+                            crossing += 1
+                            if crossing == needed:
+                                break
+                else:
+                    for shift in shifts:
+                        union |= union >> shift
+                    crossing = bcb.popcount(union & first)
+                if crossing < needed:
+                    chosen_squares = 0
+                    break
+
+        self.depth_types[depth] = chosen
+        self.candidates[depth] = chosen_squares & self.allowed[depth]
+        remaining[chosen] -= 1
+
+    def next_leaf(self, max_nodes=None):
+        """Continue the search until the next placement of all pieces.
+
+        Returns True when all pieces (or depth_limit pieces) are placed -
+        their squares are then in self.squares - and False when the search
+        is finished. With `max_nodes` the search is suspended after placing
+        that many pieces and None is returned; calling next_leaf() again
+        resumes it.
+        """
+        if self.done:
+            return False
+        if self.limit == 0:
+            self.done = True
+            return True
+
+        candidates = self.candidates
+        squares = self.squares
+        domains = self.domains
+        depth_types = self.depth_types
+        conflicts = self.conflicts
+        remaining = self.remaining
+        type_range = range(len(self.classes))
+        last = self.limit - 1
+        depth = self.depth
+        nodes = self.nodes
+        budget = -1 if max_nodes is None else max_nodes
+        # the domains of the next depth are derived when placing a piece,
+        # so there is nothing to take back at the previous leaf
+        self.at_leaf = False
+
+        while True:
+            candidate_squares = candidates[depth]
+            if not candidate_squares:
+                remaining[depth_types[depth]] += 1
+                if depth == 0:
+                    self.done = True
+                    self.nodes = nodes
+                    return False
+                depth -= 1
+                continue
+
+            low_bit = candidate_squares & -candidate_squares
+            candidates[depth] = candidate_squares ^ low_bit
+            square = low_bit.bit_length() - 1
+            squares[depth] = square
+            nodes += 1
+            budget -= 1
+
+            if depth == last:
+                self.at_leaf = True
+                result = True
+            else:
+                domain = domains[depth]
+                type_conflicts = conflicts[depth_types[depth]]
+                depth += 1
+                next_domain = domains[depth]
+                for type_index in type_range:
+                    next_domain[type_index] = (
+                        domain[type_index]
+                        & ~type_conflicts[type_index][square])
+                self.choose(depth)
+                if budget:
+                    continue
+                result = None
+
+            self.depth = depth
+            self.nodes = nodes
+            return result
+
+    def walk(self, depth_limit=None, cancel=None):
+        """Generate all placements, yielding when the pieces are placed.
+
+        The search stops early once the `cancel` token
+        (searchcontrol.CancelToken) is cancelled, its time budget is
+        checked every searchcontrol.CHECK_NODES nodes.
+        """
+        self.reset(depth_limit)
+        if cancel is None:
+            while self.next_leaf():
+                yield
+            return
+
+        # the clock is read once per CHECK_NODES nodes, cancelling from
+        # another thread is seen at the next leaf
+        next_check = 0
+        while True:
+            if self.nodes >= next_check:
+                if cancel.check():
+                    return
+                next_check = self.nodes + searchcontrol.CHECK_NODES
+            elif cancel.cancelled:
+                return
+            leaf = self.next_leaf(next_check - self.nodes)
+            if leaf:
+                yield
+            elif leaf is False:
+                return
+
+    def positions(self):
+        """Get (row, column) positions of the placed pieces."""
+        placed = self.depth + 1 if self.at_leaf else self.depth
+
+        return [divmod(square, self.cols) for square in self.squares[:placed]]
@@ -0,0 +1,267 @@
+"""Module containing a persistent store of computed compositions."""
+
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import pieces as pcs
+
+try:
+    import fcntl
+except ImportError:
+    # no locking between processes on platforms without fcntl
+    fcntl = None
+
+
+def type_key(PieceClass):
+    """Get the name of a piece type, with the moves of defined pieces.
+
+    Pieces defined by pieces.define_piece are keyed by their leaps and
+    rides too, e.g. 'Camel[1.3;]', so pieces of the same name but other
+    moves are different problems.
+    """
+    moves = pcs.definition(PieceClass)
+    if moves is None:
+        return PieceClass.NAME
+
+    return "{}[{};{}]".format(PieceClass.NAME, *[
+        "+".join("{}.{}".format(*vector) for vector in moves[kind])
+        for kind in ('leaps', 'rides')
+    ])
+
+
+def signature(rows, cols, piece_types):
+    """Get the problem signature of given chessboard dimensions and pieces.
+
+    Solutions of a transposed chessboard are the transposed solutions, so
+    the dimensions are normalised to (smaller, larger). Pieces are counted
+    by their type_key(), e.g. '4x6:Bishop2,King1'.
+    """
+    counts = Counter(type_key(PieceClass) for PieceClass in piece_types)
+
+    return "{}x{}:{}".format(
+        min(rows, cols), max(rows, cols),
+        ",".join(
+            "{}{}".format(name, count)
+            for name, count in sorted(counts.items()))
+    )
+
+
+class ResultStore(object):
+    """Represents a directory of computed results shared between processes.
+
+    Every problem signature has an entry in the index file holding the
+    (solutions, canonical solutions) counts and optionally the name of
+    a data file with all compositions. Compositions are stored in the
+    normalised orientation (rows <= cols) as fixed-width records - one byte
+    with the square number (row * cols + column) per piece. The pieces are
+    ordered by type name and square, so the types need not be stored.
+
+    The least recently used entries are evicted when there are more than
+    `max_entries` entries or their data files take more than `max_bytes`.
+    All operations hold an exclusive lock of the store, files are replaced
+    atomically. A missing or damaged data file is a cache miss.
+    """
+
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = 'lock'
+
+    def __init__(self, path, max_entries=1000, max_bytes=1 << 30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @contextmanager
+    def locked_index(self):
+        """Lock the store and yield its index.
+
+        The index is written back when it was modified by the caller.
+        """
+        with open(os.path.join(self.path, self.LOCK_FILE), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index_path = os.path.join(self.path, self.INDEX_FILE)
+                try:
+                    with open(index_path) as index_file:
+                        index = json.load(index_file)
+                except (IOError, ValueError):
+                    index = {}
+                original = json.dumps(index, sort_keys=True)
+
+                yield index
+
+                if json.dumps(index, sort_keys=True) != original:
+                    self.write_atomic(
+                        index_path, json.dumps(index).encode('ascii'))
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def write_temp(self, data):
+        """Write data to a new temporary file of the store, get its path."""
+        handle, temp_path = tempfile.mkstemp(dir=self.path)
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                temp_file.write(data)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        return temp_path
+
+    def write_atomic(self, path, data):
+        """Write data to a temporary file and move it to the path."""
+        temp_path = self.write_temp(data)
+        try:
+            os.rename(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def get_counts(self, rows, cols, piece_types):
+        """Get stored (solutions, canonical solutions) counts or None."""
+        with self.locked_index() as index:
+            entry = index.get(signature(rows, cols, piece_types))
+            if entry is None:
+                return None
+            entry['accessed'] = time.time()
+
+            return tuple(entry['counts'])
+
+    def get(self, rows, cols, piece_types):
+        """Get stored (counts, set of compositions) of a problem or None.
+
+        A missing or damaged data file is treated as if the compositions
+        were not stored, the counts are kept.
+        """
+        with self.locked_index() as index:
+            entry = index.get(signature(rows, cols, piece_types))
+            if entry is None or entry['file'] is None:
+                return None
+            counts = tuple(entry['counts'])
+            data_path = os.path.join(self.path, entry['file'])
+            try:
+                with open(data_path, 'rb') as data:
+                    records = data.read()
+            except (IOError, OSError):
+                records = None
+            if (records is None
+                    or len(records) != counts[0] * len(piece_types)):
+                entry['file'] = None
+                entry['size'] = 0
+                try:
+                    os.remove(data_path)
+                except OSError:
+                    pass
+                return None
+            entry['accessed'] = time.time()
+
+        if not piece_types:
+            # records of empty compositions take no space
+            return counts, set([frozenset()]) if counts[0] else set()
+
+        return counts, self.decode(records, rows, cols, piece_types)
+
+    def get_compositions(self, rows, cols, piece_types):
+        """Get the stored set of compositions or None."""
+        stored = self.get(rows, cols, piece_types)
+
+        return None if stored is None else stored[1]
+
+    def put(self, rows, cols, piece_types, counts, compositions=None):
+        """Store the counts and optionally the compositions of a problem.
+
+        The data file is written under a temporary name and renamed while
+        the store is locked, so an eviction by another process can not
+        remove it before it is in the index.
+        """
+        key = signature(rows, cols, piece_types)
+        data_file = None
+        temp_path = None
+        size = 0
+        if compositions is not None:
+            records = self.encode(compositions, rows, cols)
+            data_file = "{}.bin".format(
+                key.replace(':', '_').replace(',', '_'))
+            size = len(records)
+            temp_path = self.write_temp(records)
+
+        try:
+            with self.locked_index() as index:
+                if temp_path is not None:
+                    os.rename(temp_path, os.path.join(self.path, data_file))
+                    temp_path = None
+                previous = index.get(key)
+                if (compositions is None and previous is not None
+                        and previous['file'] is not None):
+                    # keep the stored compositions
+                    data_file = previous['file']
+                    size = previous['size']
+                index[key] = {
+                    'counts': list(counts),
+                    'file': data_file,
+                    'size': size,
+                    'accessed': time.time()
+                }
+                self.evict(index)
+        finally:
+            if temp_path is not None:
+                os.remove(temp_path)
+
+    def evict(self, index):
+        """Remove least recently used entries over the store limits."""
+        entries = sorted(index, key=lambda key: index[key]['accessed'])
+        total_size = sum(entry['size'] for entry in index.values())
+
+        while entries and (len(index) > self.max_entries
+                           or total_size > self.max_bytes):
+            entry = index.pop(entries.pop(0))
+            total_size -= entry['size']
+            if entry['file'] is not None:
+                try:
+                    os.remove(os.path.join(self.path, entry['file']))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def encode(compositions, rows, cols):
+        """Encode compositions as fixed-width records of squares."""
+        transpose = rows > cols
+        width = max(rows, cols)
+        records = bytearray()
+        for composition in compositions:
+            records.extend(
+                square for _, square in sorted(
+                    (PieceClass.NAME,
+                     col * width + row if transpose else row * width + col)
+                    for PieceClass, row, col in composition)
+            )
+
+        return bytes(records)
+
+    @staticmethod
+    def decode(records, rows, cols, piece_types):
+        """Decode fixed-width records of squares to compositions."""
+        transpose = rows > cols
+        width = max(rows, cols)
+        classes = sorted(piece_types, key=lambda PieceClass: PieceClass.NAME)
+        records = bytearray(records)
+        compositions = set()
+        for start in range(0, len(records), len(classes)):
+            composition = []
+            for PieceClass, square in zip(
+                    classes, records[start:start + len(classes)]):
+                row, col = divmod(square, width)
+                if transpose:
+                    row, col = col, row
+                composition.append((PieceClass, row, col))
+            compositions.add(frozenset(composition))
+
+        return compositions
@@ -0,0 +1,40 @@
+"""Module for stopping searches early.
+
+Searches check a CancelToken while they run and stop as soon as it is
+cancelled, keeping the compositions found so far. The token may be
+cancelled from another thread, e.g. by a server whose client has gone,
+or by itself when its time budget has passed. Reading the clock is
+comparatively slow, so searches only check the time budget once every
+CHECK_NODES nodes.
+"""
+
+from timeit import default_timer
+
+
+# nodes searched between checks of the time budget
+CHECK_NODES = 1024
+
+
+class CancelToken(object):
+    """Cooperative cancellation of a search."""
+
+    def __init__(self, time_budget=None):
+        self.cancelled = False
+        self.deadline = None
+        if time_budget is not None:
+            self.expire_after(time_budget)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def expire_after(self, seconds):
+        """Cancel the token when the given time has passed."""
+        self.deadline = default_timer() + seconds
+
+    def check(self):
+        """Check if the search should stop, cancelling an expired token."""
+        if (not self.cancelled and self.deadline is not None
+                and default_timer() > self.deadline):
+            self.cancelled = True
+
+        return self.cancelled
@@ -0,0 +1,117 @@
+"""Module for collecting statistics of the composition search."""
+
+import json
+import logging
+from timeit import default_timer
+
+
+class SearchStats(object):
+    """Statistics of a composition search.
+
+    nodes - number of visited search tree nodes below the root, i.e.
+        placed pieces
+    placements_attempted - number of positions considered for a piece
+    rejected_blocked - attempted positions which were occupied or
+        threatened
+    rejected_threatens - attempted positions from which the piece would
+        threaten an already placed piece
+    pruned - number of branches cut by the composer's prune
+    backtracks - number of pieces taken back from the chessboard at every
+        depth (depth 1 being the first piece)
+    subtree_times - (row, column, seconds) of every subtree of the first
+        piece
+
+    Searches which do not collect all of them set `collected` to the names
+    of those they do, only these are reported.
+    """
+
+    # statistics collected by every engine
+    BASIC = ('nodes',)
+
+    def __init__(self):
+        self.nodes = 0
+        self.placements_attempted = 0
+        self.rejected_blocked = 0
+        self.rejected_threatens = 0
+        self.pruned = 0
+        self.backtracks = []
+        self.subtree_times = []
+        # names of the collected statistics, None for all of them
+        self.collected = None
+
+    def as_dict(self):
+        stats = {
+            'nodes': self.nodes,
+            'placements_attempted': self.placements_attempted,
+            'rejected_blocked': self.rejected_blocked,
+            'rejected_threatens': self.rejected_threatens,
+            'pruned': self.pruned,
+            'backtracks': list(self.backtracks),
+            'subtree_times': [list(times) for times in self.subtree_times]
+        }
+        if self.collected is not None:
+            stats = dict((name, stats[name]) for name in self.collected)
+
+        return stats
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+class InstrumentedChessboard(object):
+    """Chessboard wrapper which records SearchStats of every operation.
+
+    The composer only wraps its chessboard when statistics are requested,
+    so searches without statistics run the unmodified chessboard code.
+    Other attributes are taken from the wrapped chessboard.
+    """
+
+    def __init__(self, chessboard, stats):
+        self.chessboard = chessboard
+        self.stats = stats
+        self.depth = 0
+        self._subtree_start = None
+
+    def __getattr__(self, name):
+        return getattr(self.chessboard, name)
+
+    def is_blocked(self, pos):
+        self.stats.placements_attempted += 1
+        if self.chessboard.is_blocked(pos):
+            self.stats.rejected_blocked += 1
+            return True
+
+        return False
+
+    def add(self, piece, pos):
+        if not self.chessboard.add(piece, pos):
+            self.stats.rejected_threatens += 1
+            return False
+
+        self.stats.nodes += 1
+        if self.depth == 0:
+            self._subtree_start = default_timer()
+        self.depth += 1
+
+        return True
+
+    def remove(self, piece):
+        position = piece.position
+        if not self.chessboard.remove(piece):
+            return False
+
+        backtracks = self.stats.backtracks
+        if len(backtracks) < self.depth:
+            backtracks.extend([0] * (self.depth - len(backtracks)))
+        backtracks[self.depth - 1] += 1
+        self.depth -= 1
+
+        if self.depth == 0:
+            seconds = default_timer() - self._subtree_start
+            self.stats.subtree_times.append(
+                (position[0], position[1], seconds))
+            logging.debug(
+                "Searched subtree of first piece at %s, %s in %s",
+                position[0], position[1], seconds)
+
+        return True
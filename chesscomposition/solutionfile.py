@@ -0,0 +1,295 @@
+"""Module for reading and writing compositions in a compact binary format.
+
+A solution file starts with a header:
+
+    magic       4 bytes, b'CHSC'
+    version     1 byte
+    rows        1 byte
+    cols        1 byte
+    pieces      1 byte, number of pieces in every composition
+    types       1 byte, number of piece types
+    type names  for every type one byte with the name length followed by
+                the ASCII piece name, e.g. b'\\x04King'
+
+and continues with fixed-width records, one per composition. Every record
+holds a (type, square) pair of bytes per piece, where type is the index of
+the piece name in the header and square is row * cols + column. The pairs
+are sorted, so every composition has exactly one record.
+
+Version 2 files, written when there are pieces defined with
+pieces.define_piece, have one more header field after the type names
+
+    definitions 2 bytes with the length followed by the JSON list of
+                pieces.definitions() of the types
+
+so the pieces are defined again when the file is read.
+"""
+
+import json
+import mmap
+import struct
+from collections import namedtuple
+
+import pieces as pcs
+
+
+MAGIC = b'CHSC'
+VERSION = 1
+# version of files with piece definitions
+DEFINITIONS_VERSION = 2
+
+HEADER = struct.Struct('<4sBBBBB')
+DEFINITIONS_LENGTH = struct.Struct('<H')
+
+Header = namedtuple(
+    'Header',
+    ('rows', 'cols', 'pieces', 'type_names', 'definitions', 'size'))
+
+
+def piece_classes():
+    """Get all known piece classes by their names."""
+    classes = {}
+    pending = [pcs.Piece]
+    while pending:
+        PieceClass = pending.pop()
+        pending.extend(PieceClass.__subclasses__())
+        if hasattr(PieceClass, 'NAME'):
+            classes[PieceClass.NAME] = PieceClass
+
+    return classes
+
+
+def read_header(data):
+    """Read the header from the beginning of a bytes-like object."""
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated solution file header")
+    magic, version, rows, cols, num_pieces, num_types = HEADER.unpack_from(
+        data)
+    if magic != MAGIC or version not in (VERSION, DEFINITIONS_VERSION):
+        raise ValueError("Not a solution file")
+
+    offset = HEADER.size
+    type_names = []
+    for _ in range(num_types):
+        length = bytearray(data[offset:offset + 1])
+        if not length or len(data) < offset + 1 + length[0]:
+            raise ValueError("Truncated solution file header")
+        type_names.append(
+            bytes(data[offset + 1:offset + 1 + length[0]]).decode('ascii'))
+        offset += 1 + length[0]
+
+    definitions = []
+    if version == DEFINITIONS_VERSION:
+        if len(data) < offset + DEFINITIONS_LENGTH.size:
+            raise ValueError("Truncated solution file header")
+        length, = DEFINITIONS_LENGTH.unpack_from(data, offset)
+        offset += DEFINITIONS_LENGTH.size
+        if len(data) < offset + length:
+            raise ValueError("Truncated solution file header")
+        try:
+            definitions = json.loads(
+                bytes(data[offset:offset + length]).decode('ascii'))
+        except ValueError:
+            raise ValueError("Wrong piece definitions in solution file")
+        offset += length
+
+    return Header(
+        rows, cols, num_pieces, tuple(type_names), definitions, offset)
+
+
+def header_types(header, classes=None):
+    """Get the piece types of a header by their index.
+
+    The pieces defined in the header are defined first, other names are
+    looked up in `classes`, by default all known piece classes. Raises
+    ValueError for unknown names and definitions clashing with pieces
+    already defined.
+    """
+    defined = dict(
+        (PieceClass.NAME, PieceClass)
+        for PieceClass in pcs.define_pieces(header.definitions))
+    if classes is None:
+        classes = piece_classes()
+
+    types = []
+    for name in header.type_names:
+        PieceClass = defined.get(name, classes.get(name))
+        if PieceClass is None:
+            raise ValueError(
+                "Unknown piece in solution file: {}".format(name))
+        types.append(PieceClass)
+
+    return tuple(types)
+
+
+def read_header_file(fileobj):
+    """Read the header from the current position of a file object."""
+    data = fileobj.read(HEADER.size)
+    if len(data) < HEADER.size:
+        return read_header(data)
+    for _ in range(bytearray(data)[-1]):
+        length = fileobj.read(1)
+        data += length
+        if length:
+            data += fileobj.read(bytearray(length)[0])
+    if bytearray(data)[4] == DEFINITIONS_VERSION:
+        length = fileobj.read(DEFINITIONS_LENGTH.size)
+        data += length
+        if len(length) == DEFINITIONS_LENGTH.size:
+            data += fileobj.read(DEFINITIONS_LENGTH.unpack(length)[0])
+
+    return read_header(data)
+
+
+class SolutionWriter(object):
+    """Writes compositions to a binary file object.
+
+    The header is written on creation unless `write_header` is False,
+    which is used to append records to an existing file.
+    """
+
+    def __init__(self, fileobj, rows, cols, piece_types, write_header=True):
+        self.fileobj = fileobj
+        self.cols = cols
+        self.type_names = tuple(sorted(set(
+            PieceClass.NAME for PieceClass in piece_types)))
+        self.type_ids = dict(
+            (name, type_id) for type_id, name in enumerate(self.type_names))
+        self.count = 0
+
+        if write_header:
+            definitions = pcs.definitions(piece_types)
+            header = bytearray(HEADER.pack(
+                MAGIC, DEFINITIONS_VERSION if definitions else VERSION,
+                rows, cols, len(piece_types), len(self.type_names)))
+            for name in self.type_names:
+                header.append(len(name))
+                header.extend(name.encode('ascii'))
+            if definitions:
+                data = json.dumps(definitions).encode('ascii')
+                header.extend(DEFINITIONS_LENGTH.pack(len(data)))
+                header.extend(data)
+            self.fileobj.write(bytes(header))
+
+    def encode(self, composition):
+        """Encode a composition as a record."""
+        record = bytearray()
+        for type_id, square in sorted(
+                (self.type_ids[PieceClass.NAME], row * self.cols + col)
+                for PieceClass, row, col in composition):
+            record.append(type_id)
+            record.append(square)
+
+        return bytes(record)
+
+    def write(self, composition):
+        """Write a single composition."""
+        self.fileobj.write(self.encode(composition))
+        self.count += 1
+
+    def write_all(self, compositions):
+        """Write all compositions from an iterable."""
+        for composition in compositions:
+            self.write(composition)
+
+
+class SolutionReader(object):
+    """Reads compositions sequentially from a binary file object."""
+
+    # number of records read at once
+    CHUNK_RECORDS = 4096
+
+    def __init__(self, fileobj, classes=None):
+        self.fileobj = fileobj
+        self.header = read_header_file(fileobj)
+        self.types = header_types(self.header, classes)
+
+    @property
+    def record_size(self):
+        return 2 * self.header.pieces
+
+    def decode(self, record):
+        """Decode a record to a composition."""
+        record = bytearray(record)
+        cols = self.header.cols
+
+        return frozenset(
+            (self.types[record[i]],) + divmod(record[i + 1], cols)
+            for i in range(0, len(record), 2)
+        )
+
+    def __iter__(self):
+        record_size = self.record_size
+        if record_size == 0:
+            return
+        while True:
+            chunk = self.fileobj.read(record_size * self.CHUNK_RECORDS)
+            for start in range(
+                    0, len(chunk) - record_size + 1, record_size):
+                yield self.decode(chunk[start:start + record_size])
+            if len(chunk) < record_size * self.CHUNK_RECORDS:
+                return
+
+
+class MappedSolutionReader(SolutionReader):
+    """Gives random access to compositions of a memory-mapped file.
+
+    Only the accessed pages of the file are loaded to memory, so files
+    larger than the available memory can be scanned.
+    """
+
+    def __init__(self, path, classes=None):
+        self._file = open(path, 'rb')
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.header = read_header(self.data)
+            self.types = header_types(self.header, classes)
+        except ValueError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+    def __len__(self):
+        if self.record_size == 0:
+            return 0
+
+        return (len(self.data) - self.header.size) // self.record_size
+
+    def record(self, index):
+        """Get the raw record of a composition."""
+        if not 0 <= index < len(self):
+            raise IndexError("Record index out of range")
+        start = self.header.size + index * self.record_size
+
+        return self.data[start:start + self.record_size]
+
+    def __getitem__(self, index):
+        return self.decode(self.record(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def write_solutions(path, rows, cols, piece_types, compositions):
+    """Write compositions to a new file, returns the number of records."""
+    with open(path, 'wb') as fileobj:
+        writer = SolutionWriter(fileobj, rows, cols, piece_types)
+        writer.write_all(compositions)
+
+    return writer.count
+
+
+def read_solutions(path, classes=None):
+    """Read all compositions from a file."""
+    with open(path, 'rb') as fileobj:
+        return set(SolutionReader(fileobj, classes))
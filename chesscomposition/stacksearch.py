@@ -0,0 +1,354 @@
+"""Module containing a non-recursive composition search engine."""
+
+import bitboard as bcb
+import pieces as pcs
+import searchcontrol
+
+
+class StackSearch(object):
+    """Searches piece placements with an explicit stack of bitmasks.
+
+    The pieces are placed in the given order, one piece per depth of the
+    stack. All state is kept in lists indexed by depth which are allocated
+    once:
+
+        candidates - bitmask of squares still to be tried at the depth
+        squares - square number (row * cols + column) of the placed piece
+        saved_occupied, saved_threatened - chessboard masks before the piece
+            was placed
+
+    Candidate squares exclude all blocked squares, so the loop only checks
+    whether the placed piece would threaten already placed pieces. Identical
+    pieces are placed in increasing square order.
+
+    The search can be suspended after a given number of nodes and resumed
+    later, see next_leaf().
+
+    With `ordering` 'dynamic' the piece types are not placed in the given
+    order. Instead, every depth places a piece of the remaining type with
+    the fewest legal squares, and a subtree is pruned as soon as any type
+    has fewer legal squares than pieces left to place. Only the first
+    piece keeps its type, because the chessboard symmetries are reduced
+    by restricting it to `top_squares`. The type placed at every depth is
+    in self.depth_types as an index to self.classes.
+    """
+
+    ORDERINGS = ('static', 'dynamic')
+
+    def __init__(self, rows, cols, piece_types, top_squares=None, prefix=(),
+                 ordering='static'):
+        if ordering not in self.ORDERINGS:
+            raise ValueError("Unknown ordering: {}".format(ordering))
+        self.rows = rows
+        self.cols = cols
+        self.piece_types = tuple(piece_types)
+        self.ordering = ordering
+        self.full = (1 << (rows * cols)) - 1
+
+        num_pieces = len(self.piece_types)
+        # distinct piece types in the order of their first placement
+        self.classes = []
+        for PieceClass in self.piece_types:
+            if PieceClass not in self.classes:
+                self.classes.append(PieceClass)
+        self.depth_types = [
+            self.classes.index(PieceClass) for PieceClass in self.piece_types]
+
+        self.masks = [
+            pcs.attack_table(PieceClass, rows, cols).masks
+            for PieceClass in self.piece_types
+        ]
+        # whether the piece at a depth is identical to the previous one
+        self.same_type = [False] + [
+            self.piece_types[depth] is self.piece_types[depth - 1]
+            for depth in range(1, num_pieces)
+        ]
+        # candidate squares allowed at a depth regardless of the chessboard
+        self.allowed = [self.full] * num_pieces
+        if num_pieces and top_squares is not None:
+            self.allowed[0] = 0
+            for square in top_squares:
+                self.allowed[0] |= 1 << square
+        for depth, square in enumerate(prefix[:num_pieces]):
+            self.allowed[depth] = 1 << square
+
+        self.candidates = [0] * num_pieces
+        self.squares = [0] * num_pieces
+        self.saved_occupied = [0] * num_pieces
+        self.saved_threatened = [0] * num_pieces
+
+        if ordering == 'dynamic':
+            num_types = len(self.classes)
+            self.type_masks = [
+                pcs.attack_table(PieceClass, rows, cols).masks
+                for PieceClass in self.classes
+            ]
+            # squares from which a type would attack a given square
+            self.type_reverse_masks = [
+                bcb.reverse_masks(masks) for masks in self.type_masks]
+            self.type_counts = [
+                self.piece_types.count(PieceClass)
+                for PieceClass in self.classes
+            ]
+            # squares from which every type would attack a placed piece
+            self.forbidden = [[0] * num_types for _ in range(num_pieces)]
+            # last square of the type placed at a depth before the placement
+            self.saved_last = [-1] * num_pieces
+
+        self.reset()
+
+    def reset(self, depth_limit=None):
+        """Start the search from the empty chessboard.
+
+        With `depth_limit` the search stops after placing that many pieces.
+        """
+        self.limit = len(self.piece_types)
+        if depth_limit is not None:
+            self.limit = min(depth_limit, self.limit)
+        self.depth = 0
+        self.occupied = 0
+        self.threatened = 0
+        self.done = False
+        self.at_leaf = False
+        # number of placed pieces
+        self.nodes = 0
+        if self.ordering == 'dynamic':
+            self.remaining = list(self.type_counts)
+            # last square of every type, identical pieces are placed in
+            # increasing square order
+            self.last = [-1] * len(self.classes)
+            if self.limit:
+                self.choose(0, 0, 0)
+        elif self.limit:
+            self.candidates[0] = self.allowed[0]
+
+    def choose(self, depth, occupied, threatened):
+        """Choose the piece type placed at a depth and its candidates.
+
+        The first piece always has the first type. The candidates are left
+        empty when some type has fewer legal squares than remaining pieces.
+        """
+        free = self.full & ~(occupied | threatened)
+        forbidden = self.forbidden[depth]
+        remaining = self.remaining
+        last = self.last
+
+        chosen = None
+        chosen_squares = 0
+        fewest = None
+        for type_index in range(len(remaining)):
+            if not remaining[type_index]:
+                continue
+            legal = free & ~forbidden[type_index] & ~(
+                (1 << (last[type_index] + 1)) - 1)
+            count = bcb.popcount(legal)
+            if count < remaining[type_index]:
+                # no placement of the remaining pieces exists
+                chosen, chosen_squares = type_index, 0
+                break
+            if depth == 0 and type_index != 0:
+                continue
+            if fewest is None or count < fewest:
+                chosen, chosen_squares, fewest = type_index, legal, count
+
+        self.depth_types[depth] = chosen
+        self.candidates[depth] = chosen_squares & self.allowed[depth]
+        self.saved_last[depth] = last[chosen]
+        remaining[chosen] -= 1
+
+    def next_leaf(self, max_nodes=None):
+        """Continue the search until the next placement of all pieces.
+
+        Returns True when all pieces (or depth_limit pieces) are placed -
+        their squares are then in self.squares - and False when the search
+        is finished. With `max_nodes` the search is suspended after placing
+        that many pieces and None is returned; calling next_leaf() again
+        resumes it.
+        """
+        if self.done:
+            return False
+        if self.limit == 0:
+            self.done = True
+            return True
+        if self.ordering == 'dynamic':
+            return self.next_leaf_dynamic(max_nodes)
+
+        candidates = self.candidates
+        squares = self.squares
+        saved_occupied = self.saved_occupied
+        saved_threatened = self.saved_threatened
+        masks = self.masks
+        allowed = self.allowed
+        same_type = self.same_type
+        full = self.full
+        last = self.limit - 1
+        depth = self.depth
+        occupied = self.occupied
+        threatened = self.threatened
+        nodes = self.nodes
+        budget = -1 if max_nodes is None else max_nodes
+
+        if self.at_leaf:
+            # take back the piece placed at the previous leaf
+            self.at_leaf = False
+            occupied = saved_occupied[depth]
+            threatened = saved_threatened[depth]
+
+        while True:
+            candidate_squares = candidates[depth]
+            if not candidate_squares:
+                if depth == 0:
+                    self.done = True
+                    self.nodes = nodes
+                    return False
+                depth -= 1
+                occupied = saved_occupied[depth]
+                threatened = saved_threatened[depth]
+                continue
+
+            low_bit = candidate_squares & -candidate_squares
+            candidates[depth] = candidate_squares ^ low_bit
+            square = low_bit.bit_length() - 1
+            mask = masks[depth][square]
+            if mask & occupied:
+                continue
+
+            saved_occupied[depth] = occupied
+            saved_threatened[depth] = threatened
+            squares[depth] = square
+            occupied |= low_bit
+            threatened |= mask
+            nodes += 1
+            budget -= 1
+
+            if depth == last:
+                self.at_leaf = True
+                result = True
+            else:
+                depth += 1
+                free = full & ~(occupied | threatened) & allowed[depth]
+                if same_type[depth]:
+                    free &= ~((low_bit << 1) - 1)
+                candidates[depth] = free
+                if budget:
+                    continue
+                result = None
+
+            self.depth = depth
+            self.occupied = occupied
+            self.threatened = threatened
+            self.nodes = nodes
+            return result
+
+    def next_leaf_dynamic(self, max_nodes=None):
+        """Continue the search with dynamic ordering, see next_leaf()."""
+        candidates = self.candidates
+        squares = self.squares
+        saved_occupied = self.saved_occupied
+        saved_threatened = self.saved_threatened
+        depth_types = self.depth_types
+        type_masks = self.type_masks
+        type_reverse_masks = self.type_reverse_masks
+        forbidden = self.forbidden
+        remaining = self.remaining
+        last_squares = self.last
+        saved_last = self.saved_last
+        type_range = range(len(self.classes))
+        last = self.limit - 1
+        depth = self.depth
+        occupied = self.occupied
+        threatened = self.threatened
+        nodes = self.nodes
+        budget = -1 if max_nodes is None else max_nodes
+
+        if self.at_leaf:
+            self.at_leaf = False
+            occupied = saved_occupied[depth]
+            threatened = saved_threatened[depth]
+
+        while True:
+            candidate_squares = candidates[depth]
+            if not candidate_squares:
+                type_index = depth_types[depth]
+                remaining[type_index] += 1
+                last_squares[type_index] = saved_last[depth]
+                if depth == 0:
+                    self.done = True
+                    self.nodes = nodes
+                    return False
+                depth -= 1
+                occupied = saved_occupied[depth]
+                threatened = saved_threatened[depth]
+                continue
+
+            # candidates hold only legal squares
+            low_bit = candidate_squares & -candidate_squares
+            candidates[depth] = candidate_squares ^ low_bit
+            square = low_bit.bit_length() - 1
+            type_index = depth_types[depth]
+
+            saved_occupied[depth] = occupied
+            saved_threatened[depth] = threatened
+            squares[depth] = square
+            last_squares[type_index] = square
+            occupied |= low_bit
+            threatened |= type_masks[type_index][square]
+            nodes += 1
+            budget -= 1
+
+            if depth == last:
+                self.at_leaf = True
+                result = True
+            else:
+                forbidden_above = forbidden[depth]
+                depth += 1
+                forbidden_here = forbidden[depth]
+                for other in type_range:
+                    forbidden_here[other] = (
+                        forbidden_above[other]
+                        | type_reverse_masks[other][square])
+                self.choose(depth, occupied, threatened)
+                if budget:
+                    continue
+                result = None
+
+            self.depth = depth
+            self.occupied = occupied
+            self.threatened = threatened
+            self.nodes = nodes
+            return result
+
+    def walk(self, depth_limit=None, cancel=None):
+        """Generate all placements, yielding when the pieces are placed.
+
+        The search stops early once the `cancel` token
+        (searchcontrol.CancelToken) is cancelled, its time budget is
+        checked every searchcontrol.CHECK_NODES nodes.
+        """
+        self.reset(depth_limit)
+        if cancel is None:
+            while self.next_leaf():
+                yield
+            return
+
+        # the clock is read once per CHECK_NODES nodes, cancelling from
+        # another thread is seen at the next leaf
+        next_check = 0
+        while True:
+            if self.nodes >= next_check:
+                if cancel.check():
+                    return
+                next_check = self.nodes + searchcontrol.CHECK_NODES
+            elif cancel.cancelled:
+                return
+            leaf = self.next_leaf(next_check - self.nodes)
+            if leaf:
+                yield
+            elif leaf is False:
+                return
+
+    def positions(self):
+        """Get (row, column) positions of the placed pieces."""
+        placed = self.depth + 1 if self.at_leaf else self.depth
+
+        return [divmod(square, self.cols) for square in self.squares[:placed]]
@@ -0,0 +1,112 @@
+"""Module containing symmetries of the chessboard."""
+
+
+def rotation(rows, cols):
+    """Get the square permutation of a counter-clockwise 90 deg. rotation.
+
+    Squares are numbered in row-major order - the (row, column) position
+    corresponds to square number row * cols + column. The rotation is
+    defined only for square chessboards.
+    """
+    return tuple(
+        (cols - 1 - col) * cols + row
+        for row in range(rows) for col in range(cols)
+    )
+
+
+def reflection(rows, cols):
+    """Get the square permutation of a reflection across the vertical axis.
+
+    The reflection swaps the left-most and right-most columns.
+    """
+    return tuple(
+        row * cols + cols - 1 - col
+        for row in range(rows) for col in range(cols)
+    )
+
+
+def vertical_reflection(rows, cols):
+    """Get the square permutation of a reflection across the horizontal axis.
+
+    The reflection swaps the top and bottom rows.
+    """
+    return tuple(
+        (rows - 1 - row) * cols + col
+        for row in range(rows) for col in range(cols)
+    )
+
+
+class SymmetryGroup(object):
+    """Represents the group of chessboard symmetries used by the search.
+
+    Square chessboards have 8 symmetries - rotations by 0, 90, 180 and
+    270 degrees and reflections across both axes and both diagonals.
+    Other chessboards have 4 symmetries - the identity, reflections across
+    both axes and the rotation by 180 degrees.
+    Every symmetry is stored as a permutation of square numbers, the first
+    one being the identity.
+
+    Compositions are compared by their keys - sorted lists of
+    (piece type rank, square) pairs. The canonical composition of an orbit
+    is the one with the smallest key. Since the key starts with the squares
+    of the first piece type, the smallest square of that type in a canonical
+    composition is the smallest square in its own orbit. It is therefore
+    enough to try only the squares of the `domain` for the first piece.
+    """
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+
+        generators = [reflection(rows, cols), vertical_reflection(rows, cols)]
+        if rows == cols:
+            generators.append(rotation(rows, cols))
+
+        # compose the generators until no new symmetries appear
+        identity = tuple(range(rows * cols))
+        self.permutations = [identity]
+        for permutation in self.permutations:
+            for generator in generators:
+                composed = tuple(generator[square] for square in permutation)
+                if composed not in self.permutations:
+                    self.permutations.append(composed)
+
+        self.domain = [
+            divmod(square, cols) for square in identity
+            if all(square <= perm[square] for perm in self.permutations)
+        ]
+
+    def __len__(self):
+        return len(self.permutations)
+
+    def orbit_size(self, key):
+        """Get the orbit size of a canonical composition.
+
+        Returns 0 if the composition given by its key is not canonical.
+        """
+        stabilizer = 1
+        for perm in self.permutations[1:]:
+            image = sorted([(rank, perm[square]) for rank, square in key])
+            if image < key:
+                return 0
+            if image == key:
+                stabilizer += 1
+
+        return len(self.permutations) // stabilizer
+
+    def canonical(self, key):
+        """Get the key of the canonical composition of an orbit."""
+        return min(
+            sorted([(rank, perm[square]) for rank, square in key])
+            for perm in self.permutations
+        )
+
+    def images(self, key):
+        """Get distinct images of a composition under all symmetries."""
+        images = [key]
+        for perm in self.permutations[1:]:
+            image = sorted([(rank, perm[square]) for rank, square in key])
+            if image not in images:
+                images.append(image)
+
+        return images
@@ -1,5 +1,12 @@
 import sys
 import os
+import shutil
+import tempfile
+import unittest
+import itertools
+import threading
+import asyncio
+from collections import Counter
 # workaround to make possible running test files without
 # nosetests test runner
 sys.path.insert(0, os.path.abspath(__file__ + "/../.."))
@@ -7,7 +14,20 @@ sys.path.insert(0, os.path.abspath(__file__ + "/../.."))
 import nose.tools as nt
 
 import pieces as pcs
+import chessboard as csb
+import checkpoint
+import chessrun
+import chessserver
+import distributed
+import dpcount
+import incremental
+import placement
 import piececomposer as comp
+import resultstore
+import searchcontrol
+import searchstats
+import solutionfile
+import npattack
 
 
 def integration_3x3_test():
@@ -34,3 +54,668 @@ def integration_3x3_test():
     piece_composer.compute()
 
     nt.assert_equal(piece_composer.found_compositions, expected_compositions)
+
+
+def engines_test():
+    params = (
+        (3, 3, (pcs.Rook, pcs.King, pcs.King)),
+        (4, 4, (pcs.Rook, pcs.Rook, pcs.Knight, pcs.Knight, pcs.Knight,
+                pcs.Knight)),
+        (3, 5, (pcs.Queen, pcs.Knight, pcs.Bishop))
+    )
+
+    for rows, cols, piece_types in params:
+        set_composer = comp.PieceComposer(rows, cols, piece_types)
+        set_composer.compute()
+
+        for engine in ('bitboard', 'stack', 'propagation'):
+            engine_composer = comp.PieceComposer(
+                rows, cols, piece_types, engine=engine)
+            engine_composer.compute()
+
+            nt.assert_equal(
+                set_composer.found_compositions,
+                engine_composer.found_compositions
+            )
+
+
+def dynamic_ordering_test():
+    params = (
+        (4, 4, (pcs.Rook, pcs.Rook, pcs.Knight, pcs.Knight, pcs.Knight,
+                pcs.Knight)),
+        (4, 5, (pcs.King, pcs.Queen, pcs.Bishop, pcs.Bishop, pcs.Knight)),
+        (3, 3, (pcs.Queen, pcs.Queen, pcs.Queen))
+    )
+
+    for rows, cols, piece_types in params:
+        static_composer = comp.PieceComposer(rows, cols, piece_types)
+        static_composer.compute()
+
+        dynamic_composer = comp.PieceComposer(
+            rows, cols, piece_types, engine='stack', ordering='dynamic')
+        dynamic_composer.compute()
+
+        nt.assert_equal(
+            static_composer.found_compositions,
+            dynamic_composer.found_compositions
+        )
+        nt.assert_equal(
+            comp.PieceComposer(
+                rows, cols, piece_types, engine='stack', ordering='dynamic'
+            ).count(workers=2),
+            (static_composer.solution_count, static_composer.canonical_count)
+        )
+
+
+def propagation_test():
+    # line capacity of sliders prunes these, fairy riders included
+    Chancellor = pcs.define_piece(
+        'Chancellor', leaps=[(1, 2)], rides=[(0, 1)])
+    params = (
+        (6, 6, (pcs.Queen,) * 6),
+        (5, 6, (pcs.Queen, pcs.Queen, pcs.Rook, pcs.Rook, pcs.Knight)),
+        (5, 5, (Chancellor, pcs.Bishop, pcs.Bishop, pcs.King)),
+        (4, 4, (pcs.Rook,) * 5)
+    )
+
+    for rows, cols, piece_types in params:
+        set_composer = comp.PieceComposer(rows, cols, piece_types)
+        set_composer.compute()
+
+        propagation_composer = comp.PieceComposer(
+            rows, cols, piece_types, engine='propagation')
+        propagation_composer.compute()
+
+        nt.assert_equal(
+            set_composer.found_compositions,
+            propagation_composer.found_compositions
+        )
+        nt.assert_equal(
+            comp.PieceComposer(
+                rows, cols, piece_types, engine='propagation'
+            ).count(workers=2),
+            (set_composer.solution_count, set_composer.canonical_count)
+        )
+
+
+def prune_test():
+    piece_types = (pcs.King, pcs.King, pcs.Queen, pcs.Queen, pcs.Bishop,
+                   pcs.Knight)
+
+    composer = comp.PieceComposer(5, 5, piece_types)
+    composer.compute()
+
+    for engine in ('set', 'bitboard'):
+        nodes = []
+        for prune in (None, 'free', 'legal'):
+            stats = searchstats.SearchStats()
+            pruning_composer = comp.PieceComposer(
+                5, 5, piece_types, engine=engine, prune=prune, stats=stats)
+            pruning_composer.compute()
+            nodes.append(stats.nodes)
+
+            nt.assert_equal(
+                composer.found_compositions,
+                pruning_composer.found_compositions
+            )
+        # nodes below pruned branches are not visited
+        nt.assert_true(nodes[0] > nodes[1] > nodes[2])
+
+
+def parallel_compute_test():
+    params = (
+        (4, 4, (pcs.Rook, pcs.Rook, pcs.Knight, pcs.Knight, pcs.Knight,
+                pcs.Knight)),
+        (3, 5, (pcs.Queen, pcs.Knight, pcs.Bishop))
+    )
+
+    for rows, cols, piece_types in params:
+        serial_composer = comp.PieceComposer(rows, cols, piece_types)
+        parallel_composer = comp.PieceComposer(rows, cols, piece_types)
+
+        serial_composer.compute()
+        parallel_composer.compute(workers=2)
+
+        nt.assert_equal(
+            serial_composer.found_compositions,
+            parallel_composer.found_compositions
+        )
+
+
+def count_only_test():
+    params = (
+        (3, 3, (pcs.Rook, pcs.King, pcs.King)),
+        (4, 4, (pcs.Rook, pcs.Rook, pcs.Knight, pcs.Knight, pcs.Knight,
+                pcs.Knight)),
+        (4, 4, (pcs.King, pcs.King, pcs.King, pcs.King)),
+        (3, 5, (pcs.Queen, pcs.Knight, pcs.Bishop))
+    )
+
+    for rows, cols, piece_types in params:
+        piece_composer = comp.PieceComposer(rows, cols, piece_types)
+        piece_composer.compute()
+
+        count_composer = comp.PieceComposer(rows, cols, piece_types)
+        solution_count, _ = count_composer.count()
+
+        nt.assert_equal(solution_count, len(piece_composer.found_compositions))
+        nt.assert_equal(count_composer.found_compositions, set())
+
+    # all four 3x3 solutions are rotations of each other
+    count_composer = comp.PieceComposer(3, 3, (pcs.Rook, pcs.King, pcs.King))
+    nt.assert_equal(count_composer.count(workers=2), (4, 1))
+
+
+def iter_compositions_test():
+    params = (
+        (4, 4, (pcs.King, pcs.King, pcs.King, pcs.King)),
+        (3, 5, (pcs.Queen, pcs.Knight, pcs.Bishop))
+    )
+
+    for rows, cols, piece_types in params:
+        piece_composer = comp.PieceComposer(rows, cols, piece_types)
+        compositions = list(piece_composer.iter_compositions())
+
+        nt.assert_equal(len(compositions), len(set(compositions)))
+        nt.assert_equal(
+            set(compositions),
+            brute_force_compositions(rows, cols, piece_types)
+        )
+
+
+def brute_force_compositions(rows, cols, piece_types):
+    """Find compositions by trying every combination of squares."""
+    squares = [(j, i) for j in range(rows) for i in range(cols)]
+    counts = Counter(piece_types)
+    compositions = set()
+
+    for combination in itertools.product(*(
+            itertools.combinations(squares, count)
+            for count in counts.values())):
+        chessboard = csb.Chessboard(rows, cols)
+        composition = frozenset(
+            (PieceClass, row, col)
+            for PieceClass, positions in zip(counts, combination)
+            for row, col in positions
+        )
+        if all(chessboard.add(PieceClass(), (row, col))
+               for PieceClass, row, col in composition):
+            compositions.add(composition)
+
+    return compositions
+
+
+def identical_pieces_test():
+    params = (
+        (4, 4, (pcs.Rook, pcs.Rook, pcs.Knight, pcs.Knight, pcs.Knight)),
+        (3, 4, (pcs.King, pcs.King, pcs.Knight, pcs.Knight, pcs.Bishop)),
+        (4, 4, (pcs.King, pcs.King, pcs.King, pcs.King))
+    )
+
+    for rows, cols, piece_types in params:
+        piece_composer = comp.PieceComposer(rows, cols, piece_types)
+        piece_composer.compute()
+
+        nt.assert_equal(
+            piece_composer.found_compositions,
+            brute_force_compositions(rows, cols, piece_types)
+        )
+
+
+def dp_count_test():
+    params = (
+        (3, 3, (pcs.King, pcs.King)),
+        (4, 5, (pcs.King, pcs.King, pcs.Knight, pcs.Knight)),
+        (6, 3, (pcs.Knight, pcs.Knight, pcs.Knight, pcs.Knight)),
+        (5, 5, (pcs.King, pcs.King, pcs.King, pcs.Knight, pcs.Knight)),
+        (4, 4, (pcs.King, pcs.King, pcs.King, pcs.King, pcs.King))
+    )
+
+    for rows, cols, piece_types in params:
+        piece_composer = comp.PieceComposer(rows, cols, piece_types)
+        piece_composer.compute()
+
+        nt.assert_equal(
+            dpcount.count_compositions(rows, cols, piece_types),
+            len(piece_composer.found_compositions)
+        )
+
+    # count() does not search kings and knights on large chessboards
+    count_composer = comp.PieceComposer(
+        7, 7, (pcs.Knight, pcs.King, pcs.Knight))
+    nt.assert_equal(count_composer.count(), (
+        dpcount.count_compositions(7, 7, count_composer.piece_types), None))
+
+    # small chessboards are searched, giving the canonical count too
+    stats = searchstats.SearchStats()
+    count_composer = comp.PieceComposer(
+        4, 5, (pcs.Knight, pcs.King, pcs.Knight), stats=stats)
+    solution_count, canonical_count = count_composer.count()
+    nt.assert_equal(solution_count, 866)
+    nt.assert_true(canonical_count > 0)
+    nt.assert_true(stats.nodes > 0)
+
+
+def result_store_test():
+    path = tempfile.mkdtemp()
+    try:
+        store = resultstore.ResultStore(path)
+        piece_types = (pcs.Queen, pcs.Knight, pcs.Bishop)
+
+        piece_composer = comp.PieceComposer(3, 5, piece_types, store=store)
+        piece_composer.compute()
+
+        stats = searchstats.SearchStats()
+        stored_composer = comp.PieceComposer(
+            5, 3, piece_types, engine='bitboard', store=store, stats=stats)
+        stored_composer.compute()
+
+        nt.assert_equal(stats.nodes, 0)
+        nt.assert_equal(
+            len(stored_composer.found_compositions),
+            len(piece_composer.found_compositions)
+        )
+        nt.assert_equal(
+            stored_composer.count(),
+            (piece_composer.solution_count, piece_composer.canonical_count)
+        )
+    finally:
+        shutil.rmtree(path)
+
+
+def extend_test():
+    params = (
+        (4, 4, (pcs.Rook, pcs.Knight, pcs.Knight), pcs.Knight),
+        (4, 5, (pcs.King, pcs.Queen, pcs.Bishop), pcs.Bishop),
+        (3, 5, (pcs.Queen, pcs.Knight), pcs.Rook),
+        (3, 3, (), pcs.King)
+    )
+
+    for rows, cols, base_types, PieceClass in params:
+        piece_types = base_types + (PieceClass,)
+        base_composer = comp.PieceComposer(rows, cols, base_types)
+        base_composer.compute()
+        piece_composer = comp.PieceComposer(rows, cols, piece_types)
+        piece_composer.compute()
+
+        extended = list(incremental.extend_compositions(
+            base_composer.found_compositions, rows, cols, PieceClass))
+        nt.assert_equal(len(extended), len(set(extended)))
+        nt.assert_equal(set(extended), piece_composer.found_compositions)
+
+        extended_composer = comp.PieceComposer(rows, cols, piece_types)
+        extended_composer.extend(
+            base_composer.found_compositions, PieceClass)
+        nt.assert_equal(
+            (extended_composer.solution_count,
+             extended_composer.canonical_count),
+            (piece_composer.solution_count, piece_composer.canonical_count)
+        )
+
+
+def extend_stored_test():
+    path = tempfile.mkdtemp()
+    try:
+        store = resultstore.ResultStore(path)
+        comp.PieceComposer(
+            5, 4, (pcs.Knight, pcs.King, pcs.Queen), store=store).compute()
+
+        # stored compositions are only extended on request
+        stats = searchstats.SearchStats()
+        comp.PieceComposer(
+            4, 5, (pcs.Knight, pcs.King, pcs.Queen, pcs.Bishop),
+            store=store, stats=stats).compute()
+        nt.assert_true(stats.nodes > 0)
+
+        stats = searchstats.SearchStats()
+        piece_composer = comp.PieceComposer(
+            4, 5, (pcs.Knight, pcs.King, pcs.Queen, pcs.Knight),
+            store=store, stats=stats, extend_base=True)
+        piece_composer.compute()
+
+        expected = comp.PieceComposer(
+            4, 5, (pcs.Knight, pcs.King, pcs.Queen, pcs.Knight))
+        expected.compute()
+
+        nt.assert_equal(stats.nodes, 0)
+        nt.assert_equal(
+            piece_composer.found_compositions, expected.found_compositions)
+        nt.assert_equal(
+            store.get_counts(4, 5, expected.piece_types),
+            (expected.solution_count, expected.canonical_count)
+        )
+
+        # extending stops at the limit and the time budget
+        limited_composer = comp.PieceComposer(
+            4, 5, (pcs.Knight, pcs.King, pcs.Queen, pcs.Rook), store=store,
+            max_solutions=5, extend_base=True)
+        limited_composer.compute()
+        nt.assert_equal(len(limited_composer.found_compositions), 5)
+        nt.assert_false(limited_composer.exhaustive)
+
+        limited_composer = comp.PieceComposer(
+            4, 5, (pcs.Knight, pcs.King, pcs.Queen, pcs.Rook), store=store,
+            time_budget=0, extend_base=True)
+        limited_composer.compute()
+        nt.assert_false(limited_composer.exhaustive)
+    finally:
+        shutil.rmtree(path)
+
+
+def compact_compositions_test():
+    rows, cols = 4, 5
+    piece_types = (pcs.King, pcs.Queen, pcs.Bishop, pcs.Bishop)
+    piece_composer = comp.PieceComposer(rows, cols, piece_types)
+    piece_composer.compute()
+    found = piece_composer.found_compositions
+
+    for engine in comp.PieceComposer.ENGINES:
+        compact_composer = comp.PieceComposer(
+            rows, cols, piece_types, engine=engine)
+        compositions = compact_composer.compact_compositions()
+        nt.assert_equal(len(compositions), len(found))
+        nt.assert_equal(compositions.nbytes, 2 * 4 * len(found))
+        nt.assert_equal(set(compositions), found)
+        nt.assert_equal(
+            compact_composer.solution_count, piece_composer.solution_count)
+
+    packed = placement.pack_compositions(found, rows, cols, piece_types)
+    nt.assert_equal(len(packed), len(found))
+    nt.assert_equal(
+        placement.unpack_compositions(packed, rows, cols, piece_types),
+        found)
+
+
+def distributed_test():
+    rows, cols = 5, 5
+    piece_types = (pcs.Queen, pcs.Rook, pcs.Knight, pcs.Knight)
+    piece_composer = comp.PieceComposer(rows, cols, piece_types)
+    piece_composer.compute()
+
+    # no time budget splits every task down to single subtrees
+    coordinator = distributed.Coordinator(
+        rows, cols, piece_types, min_prefixes=4, budget=0)
+    nt.assert_equal(
+        distributed.run_local(coordinator, workers=2),
+        (piece_composer.solution_count, piece_composer.canonical_count))
+    nt.assert_equal(
+        coordinator.found_compositions, piece_composer.found_compositions)
+    nt.assert_true(coordinator.next_id > 4)
+
+    coordinator = distributed.Coordinator(
+        rows, cols, piece_types, options={'engine': 'stack'},
+        count_only=True)
+    nt.assert_equal(
+        distributed.run_local(coordinator, workers=2),
+        (piece_composer.solution_count, piece_composer.canonical_count))
+    nt.assert_equal(coordinator.compositions, set())
+
+
+def distributed_lost_worker_test():
+    rows, cols, piece_types = 4, 4, (pcs.Rook, pcs.Knight)
+    expected = comp.PieceComposer(rows, cols, piece_types).count()
+
+    coordinator = distributed.Coordinator(
+        rows, cols, piece_types, count_only=True, min_prefixes=2)
+    address = coordinator.start()
+    try:
+        # a worker which disconnects without the result
+        connection = distributed.Connection(*address)
+        task = connection.request({'request': 'task'})
+        connection.close()
+
+        worker = threading.Thread(
+            target=distributed.run_worker, args=address)
+        worker.start()
+        nt.assert_equal(coordinator.wait(timeout=60), expected)
+        worker.join()
+    finally:
+        coordinator.stop()
+    nt.assert_equal(coordinator.attempts[task['task']], 2)
+
+    coordinator = distributed.Coordinator(
+        rows, cols, piece_types, count_only=True, lease_timeout=0,
+        max_attempts=1)
+    address = coordinator.start()
+    try:
+        connection = distributed.Connection(*address)
+        connection.request({'request': 'task'})
+        nt.assert_raises(
+            distributed.TaskFailed, coordinator.wait, timeout=60)
+        connection.close()
+    finally:
+        coordinator.stop()
+
+
+def cancel_test():
+    piece_types = (pcs.Queen, pcs.Queen, pcs.Bishop, pcs.Knight)
+    for engine in comp.PieceComposer.ENGINES:
+        cancel = searchcontrol.CancelToken()
+        piece_composer = comp.PieceComposer(
+            6, 6, piece_types, engine=engine, cancel=cancel)
+        found = []
+        for composition in piece_composer.iter_compositions():
+            found.append(composition)
+            if len(found) == 10:
+                cancel.cancel()
+        nt.assert_true(piece_composer.cancelled)
+        # compositions of the last canonical one may be yielded
+        nt.assert_true(10 <= len(found) < 20)
+
+
+def limits_test():
+    piece_types = (pcs.King, pcs.Queen, pcs.Bishop, pcs.Knight)
+    for engine in comp.PieceComposer.ENGINES:
+        piece_composer = comp.PieceComposer(
+            6, 6, piece_types, engine=engine,
+            max_solutions=13)
+        piece_composer.compute()
+        nt.assert_equal(len(piece_composer.found_compositions), 13)
+        nt.assert_equal(piece_composer.solution_count, 13)
+        nt.assert_false(piece_composer.exhaustive)
+
+        piece_composer = comp.PieceComposer(
+            6, 6, piece_types, engine=engine,
+            max_solutions=13)
+        solution_count, _ = piece_composer.count()
+        nt.assert_true(13 <= solution_count < 13 + 8)
+
+        piece_composer = comp.PieceComposer(
+            6, 6, piece_types, engine=engine,
+            max_solutions=13)
+        compositions = piece_composer.compact_compositions()
+        nt.assert_equal(len(compositions), 13)
+        nt.assert_equal(piece_composer.solution_count, 13)
+        nt.assert_false(piece_composer.exhaustive)
+
+        # an expired time budget stops the search at the first check
+        piece_composer = comp.PieceComposer(
+            6, 6, piece_types, engine=engine, time_budget=0)
+        nt.assert_true(piece_composer.count()[0] < 54208)
+        nt.assert_false(piece_composer.exhaustive)
+
+        piece_composer = comp.PieceComposer(
+            3, 3, (pcs.King, pcs.King, pcs.Rook), engine=engine,
+            time_budget=60, max_solutions=5)
+        piece_composer.compute()
+        nt.assert_equal(piece_composer.solution_count, 4)
+        nt.assert_true(piece_composer.exhaustive)
+
+    # kings and knights are counted without search, but stop as well
+    piece_types = (pcs.King, pcs.King, pcs.Knight)
+    piece_composer = comp.PieceComposer(
+        7, 7, piece_types, time_budget=0)
+    piece_composer.count()
+    nt.assert_false(piece_composer.exhaustive)
+
+    piece_composer = comp.PieceComposer(
+        6, 6, piece_types, max_solutions=13)
+    solution_count, canonical_count = piece_composer.count()
+    nt.assert_true(13 <= solution_count < 13 + 8)
+    nt.assert_true(canonical_count > 0)
+    nt.assert_false(piece_composer.exhaustive)
+
+
+def server_test():
+    async def run():
+        server = chessserver.CompositionServer(workers=2)
+        asyncio_server = await server.start()
+        address = asyncio_server.sockets[0].getsockname()[:2]
+        try:
+            message = {'rows': 5, 'cols': 5, 'pieces': ['1Q', '1R', '2N']}
+            responses = await asyncio.gather(*[
+                chessserver.query(*address, message) for _ in range(3)])
+            # the identical requests share a single search
+            started = server.started_searches
+            counted = await chessserver.query(
+                *address, dict(message, count_only=True))
+            infeasible = await chessserver.query(
+                *address, {'rows': 1, 'cols': 8, 'pieces': '2Q'})
+            wrong = [
+                await chessserver.query(*address, dict(
+                    {'rows': 3, 'cols': 3, 'pieces': '2K'}, **options))
+                for options in ({'pieces': '2X'}, {'engine': ['set']},
+                                {'timeout': -1})
+            ]
+            timed_out = await chessserver.query(
+                *address, {'rows': 7, 'cols': 7, 'pieces': '2K 2Q 2B 1N',
+                           'count_only': True, 'timeout': 0.2})
+            # counted without search, still cancelled when timed out
+            dp_timed_out = await chessserver.query(
+                *address, {'rows': 12, 'cols': 12, 'pieces': '3K 3N',
+                           'count_only': True, 'timeout': 0.2})
+            # the deadline holds while compositions keep coming
+            streamed = await chessserver.query(
+                *address, {'rows': 8, 'cols': 8, 'pieces': '3K 3N',
+                           'timeout': 0.2})
+            searches = dict(server.searches)
+        finally:
+            asyncio_server.close()
+            server.close()
+
+        return (responses, started, counted, infeasible, wrong,
+                [timed_out, dp_timed_out, streamed], searches)
+
+    (responses, started, counted, infeasible, wrong, timed_out,
+     searches) = asyncio.run(run())
+
+    piece_composer = comp.PieceComposer(
+        5, 5, (pcs.Queen, pcs.Rook, pcs.Knight, pcs.Knight))
+    piece_composer.compute()
+    expected = set(
+        chessrun.format_composition(composition)
+        for composition in piece_composer.found_compositions)
+    counts = {'solutions': 1032, 'canonical': 129, 'exhaustive': True}
+    for compositions, result in responses:
+        nt.assert_equal(set(compositions), expected)
+        nt.assert_equal(len(compositions), len(expected))
+        nt.assert_equal(result, counts)
+    nt.assert_equal(started, 1)
+    nt.assert_equal(counted, ([], counts))
+    nt.assert_equal(
+        infeasible,
+        ([], {'solutions': 0, 'canonical': 0, 'exhaustive': True}))
+    for _, result in wrong:
+        nt.assert_in('error', result)
+    for _, result in timed_out:
+        nt.assert_false(result['exhaustive'])
+    # the count by dpcount is not known before it finishes
+    nt.assert_is_none(timed_out[1][1]['canonical'])
+    # the searches of the timed out requests were cancelled
+    nt.assert_equal(searches, {})
+
+
+def fairy_pieces_test():
+    # pieces defined by the moves of orthodox ones
+    Horse = pcs.define_piece('Horse', leaps=[(1, 2)])
+    Castle = pcs.define_piece('Castle', rides=[(0, 1)])
+    Empress = pcs.define_piece('Empress', rides=[(0, 1), (1, 1)])
+    orthodox = (pcs.Queen, pcs.Rook, pcs.Knight, pcs.Knight)
+    fairy = (Empress, Castle, Horse, Horse)
+
+    expected = comp.PieceComposer(5, 5, orthodox).count()
+    for engine in comp.PieceComposer.ENGINES:
+        piece_composer = comp.PieceComposer(
+            5, 5, fairy, engine=engine)
+        nt.assert_equal(piece_composer.count(), expected)
+    # the types are pickled for worker processes
+    piece_composer = comp.PieceComposer(5, 5, fairy)
+    nt.assert_equal(piece_composer.count(workers=2), expected)
+
+    Amazon = pcs.define_piece('Amazon', leaps=[(1, 2)], rides=[(0, 1), (1, 1)])
+    piece_types = (Amazon, pcs.King, Horse)
+    piece_composer = comp.PieceComposer(5, 6, piece_types)
+    piece_composer.compute()
+    compositions = piece_composer.found_compositions
+    nt.assert_true(compositions)
+    for composition in compositions:
+        chessboard = csb.Chessboard(rows=5, cols=6)
+        for PieceClass, row, col in composition:
+            nt.assert_true(chessboard.add(PieceClass(), (row, col)))
+
+
+class InterruptedSearch(checkpoint.CheckpointedSearch):
+    """Checkpointed search killed after a number of subtrees."""
+
+    def __init__(self, saved, subtrees):
+        checkpoint.CheckpointedSearch.__init__(self, saved, interval=0)
+        self.subtrees = subtrees
+
+    def results(self):
+        for number, result in enumerate(
+                checkpoint.CheckpointedSearch.results(self)):
+            if number == self.subtrees:
+                raise KeyboardInterrupt
+            yield result
+
+
+def checkpoint_resume_test():
+    piece_types = (pcs.King, pcs.Queen, pcs.Bishop, pcs.Knight)
+    piece_composer = comp.PieceComposer(4, 5, piece_types)
+    piece_composer.compute()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'search.json')
+        output = os.path.join(directory, 'solutions.bin')
+        saved = checkpoint.Checkpoint(
+            path, 4, 5, piece_types, output=output)
+        try:
+            InterruptedSearch(saved, 5).run()
+        except KeyboardInterrupt:
+            pass
+        # solutions of a subtree which was not finished
+        with open(output, 'ab') as output_file:
+            output_file.write(b'\x00\x01\x02')
+
+        resumed = checkpoint.Checkpoint.load(path)
+        nt.assert_equal(len(resumed.done), 5)
+        nt.assert_false(resumed.finished)
+
+        counts = checkpoint.CheckpointedSearch(resumed).run()
+
+        nt.assert_true(resumed.finished)
+        nt.assert_equal(counts, (
+            piece_composer.solution_count, piece_composer.canonical_count))
+        nt.assert_equal(
+            solutionfile.read_solutions(output),
+            piece_composer.found_compositions)
+    finally:
+        shutil.rmtree(directory)
+
+
+def numpy_cross_check_test():
+    if npattack.np is None:
+        raise unittest.SkipTest("NumPy is not installed")
+
+    piece_types = (pcs.King, pcs.Queen, pcs.Bishop, pcs.Bishop, pcs.Knight)
+    for engine in sorted(comp.PieceComposer.ENGINES):
+        piece_composer = comp.PieceComposer(
+            5, 5, piece_types, engine=engine)
+        piece_composer.compute()
+
+        nt.assert_equal(
+            npattack.validate_compositions(
+                piece_composer.found_compositions, 5, 5, piece_types),
+            (6184, 0, 0)
+        )
@@ -1,5 +1,8 @@
 import sys
 import os
+import shutil
+import tempfile
+import unittest
 # workaround to make possible running test files without
 # nosetests test runner
 sys.path.insert(0, os.path.abspath(__file__ + "/../.."))
@@ -8,7 +11,17 @@ import nose.tools as nt
 
 import pieces as pcs
 import chessboard as csb
+import bitboard as bcb
 import piececomposer as comp
+import symmetry as sym
+import resultstore
+import searchstats
+import stacksearch
+import propagation
+import npattack
+import solutionfile
+import placement
+import chessrun
 
 
 def scale_compute_moves_test():
@@ -84,44 +97,502 @@ def multiple_threatened_positions_test():
     nt.assert_not_in(chessboard.blocked_positions, (6, 0))
 
 
-def chessboard_rotation_test():
-    piece_composer = comp.PieceComposer(
-        3, 3,
-        (pcs.King, pcs.King, pcs.Rook)
-    )
+def bitboard_attack_masks_test():
+    masks = bcb.attack_masks(pcs.King, 3, 3)
 
-    # just create a fake composition to try the
-    # counter-clockwise 90 deg. rotation
-    composition = frozenset((
-        (pcs.Rook, 1, 0), (pcs.King, 0, 2), (pcs.King, 2, 2)
-    ))
+    # King in the top-right corner threatens (0, 1), (1, 1) and (1, 2)
+    nt.assert_equal(masks[2], (1 << 1) | (1 << 4) | (1 << 5))
+    nt.assert_equal(len(masks), 9)
 
-    expected_rotated = frozenset((
-        (pcs.Rook, 2, 1), (pcs. King, 0, 0), (pcs.King, 0, 2)
-    ))
 
-    actual_rotated = piece_composer.rotate_composition(composition)
+def bitboard_piece_add_remove_test():
+    chessboard = bcb.BitChessboard(rows=7, cols=7)
+    bishop = pcs.Bishop()
+    rook = pcs.Rook()
 
-    nt.assert_equal(expected_rotated, actual_rotated)
+    nt.assert_true(chessboard.add(bishop, (3, 3)))
+    nt.assert_true(chessboard.is_blocked((6, 6)))
+    nt.assert_false(chessboard.add(rook, (0, 0)))
+    # rook on (3, 0) would threaten the bishop
+    nt.assert_false(chessboard.add(rook, (3, 0)))
+    nt.assert_true(chessboard.add(rook, (0, 1)))
 
+    expected_blocked = pcs.Bishop.compute_possible_moves((3, 3), 7, 7).union(
+        pcs.Rook.compute_possible_moves((0, 1), 7, 7), {(3, 3), (0, 1)})
+    nt.assert_equal(chessboard.blocked_positions, expected_blocked)
 
-def extract_symmetric_compositions_test():
-    piece_composer = comp.PieceComposer(
-        2, 2,
-        (pcs.Rook, pcs.Rook)
+    chessboard.remove(bishop)
+    chessboard.remove(rook)
+
+    nt.assert_equal(chessboard.blocked, 0)
+    nt.assert_false(chessboard.is_blocked((6, 6)))
+
+
+def attack_table_cache_test():
+    cache = pcs.AttackTableCache(maxsize=2)
+
+    table = cache.get(pcs.Knight, 5, 5)
+    nt.assert_is(cache.get(pcs.Knight, 5, 5), table)
+    nt.assert_equal(
+        table.moves[2 * 5 + 2],
+        frozenset(pcs.Knight.compute_possible_moves((2, 2), 5, 5))
     )
 
-    composition = frozenset((
-        (pcs.Rook, 0, 0), (pcs.Rook, 1, 1)
+    cache.get(pcs.Knight, 6, 6)
+    cache.get(pcs.Rook, 5, 5)
+
+    # the 5x5 knight table was the least recently used one
+    nt.assert_equal(cache.info(), pcs.CacheInfo(1, 3, 2, 2))
+    nt.assert_is_not(cache.get(pcs.Knight, 5, 5), table)
+
+
+def piece_possible_moves_shared_test():
+    chessboard = csb.Chessboard(rows=5, cols=5)
+    knight1 = pcs.Knight()
+    knight2 = pcs.Knight()
+
+    chessboard.add(knight1, (0, 0))
+    moves = knight1.possible_moves
+    chessboard.remove(knight1)
+    chessboard.add(knight2, (0, 0))
+
+    nt.assert_is(knight2.possible_moves, moves)
+
+
+def attack_tables_bound_test():
+    # chessboards look the tables up once per piece type, not per node
+    piece_types = (pcs.King, pcs.King, pcs.Queen, pcs.Bishop, pcs.Knight)
+    for engine in ('set', 'bitboard'):
+        before = pcs.attack_tables.info()
+        piece_composer = comp.PieceComposer(
+            5, 5, piece_types, engine=engine)
+        piece_composer.count()
+        after = pcs.attack_tables.info()
+        nt.assert_true(
+            after.hits + after.misses - before.hits - before.misses <= 8)
+
+
+def piece_slots_test():
+    chessboard = csb.Chessboard(rows=5, cols=5)
+    knight = pcs.Knight()
+    nt.assert_false(hasattr(knight, '__dict__'))
+
+    chessboard.add(knight, (0, 0))
+    nt.assert_equal(knight.dimensions, (5, 5))
+    nt.assert_equal(knight.possible_moves, frozenset([(1, 2), (2, 1)]))
+    chessboard.remove(knight)
+    nt.assert_is_none(knight.possible_moves)
+
+
+def placement_codec_test():
+    codec = placement.PlacementCodec(3, 4, [pcs.Rook, pcs.King, pcs.King])
+    nt.assert_equal(codec.types, (pcs.King, pcs.Rook))
+    nt.assert_equal(codec.record(pcs.Rook, 2, 1), 1 << 8 | 9)
+
+    composition = frozenset([
+        (pcs.King, 0, 0), (pcs.Rook, 2, 1), (pcs.King, 0, 3)])
+    records = codec.pack(composition)
+    nt.assert_equal(records, (0, 3, 1 << 8 | 9))
+    nt.assert_equal(codec.unpack(records), composition)
+
+    compositions = placement.CompositionArray(codec, [composition])
+    nt.assert_equal(list(compositions), [composition])
+    nt.assert_equal(compositions.packed(0), records)
+    nt.assert_raises(
+        ValueError, compositions.append, frozenset([(pcs.King, 0, 0)]))
+    nt.assert_raises(IndexError, compositions.packed, 1)
+
+
+def define_piece_test():
+    Camel = pcs.define_piece('Camel', leaps=[(1, 3)])
+    nt.assert_is(pcs.define_piece('Camel', leaps=[[1, 3]]), Camel)
+    nt.assert_is(pcs.piece_class('Camel'), Camel)
+    nt.assert_equal(
+        Camel.compute_possible_moves((0, 0), 4, 4), {(1, 3), (3, 1)})
+    nt.assert_false(hasattr(Camel(), '__dict__'))
+
+    # all rotations and reflections of the moves are included
+    Horse = pcs.define_piece('Horse', leaps=[(2, -1)])
+    nt.assert_equal(
+        sorted(Horse.RELATIVE_MOVES), sorted(pcs.Knight.RELATIVE_MOVES))
+    Nightrider = pcs.define_piece('Nightrider', rides=[(1, 2)])
+    nt.assert_equal(
+        Nightrider.compute_possible_moves((0, 0), 5, 5),
+        {(1, 2), (2, 4), (2, 1), (4, 2)})
+
+    nt.assert_equal(
+        pcs.definition(Camel),
+        {'name': 'Camel', 'leaps': [[1, 3]], 'rides': []})
+    nt.assert_is_none(pcs.definition(pcs.King))
+    nt.assert_equal(
+        pcs.definitions([pcs.King, Nightrider, Camel, Camel]),
+        [pcs.definition(Camel), pcs.definition(Nightrider)])
+
+    nt.assert_raises(ValueError, pcs.define_piece, 'Camel', leaps=[(1, 2)])
+    nt.assert_raises(ValueError, pcs.define_piece, 'King', leaps=[(1, 1)])
+    nt.assert_raises(ValueError, pcs.define_piece, 'Nothing')
+    nt.assert_raises(ValueError, pcs.define_piece, 'Zero', leaps=[(0, 0)])
+    nt.assert_raises(ValueError, pcs.define_piece, 'Bad name', rides=[(1, 0)])
+    nt.assert_raises(ValueError, pcs.piece_class, 'Unicorn')
+
+
+def solution_file_definitions_test():
+    Giraffe = pcs.define_piece('Giraffe', leaps=[(1, 4)])
+    compositions = set((
+        frozenset(((Giraffe, 0, 0), (pcs.King, 2, 2))),
+        frozenset(((Giraffe, 4, 4), (pcs.King, 2, 2)))
     ))
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        solutionfile.write_solutions(
+            path, 5, 5, (Giraffe, pcs.King), compositions)
+        # the piece is defined again from the file, as in a new process
+        del pcs.custom_pieces['Giraffe']
+        read = solutionfile.read_solutions(path)
+        Giraffe = pcs.piece_class('Giraffe')
+        nt.assert_equal(
+            read, set(frozenset(
+                (pcs.piece_class(PieceClass.NAME), row, col)
+                for PieceClass, row, col in composition)
+                for composition in compositions))
+        with solutionfile.MappedSolutionReader(path) as reader:
+            nt.assert_equal(reader.types, (Giraffe, pcs.King))
+
+        # pieces which are neither known nor defined in the file
+        solutionfile.write_solutions(path, 5, 5, (pcs.King,), [])
+        nt.assert_raises(ValueError, solutionfile.read_solutions, path, {})
+    finally:
+        os.remove(path)
 
-    expected_symmetric = frozenset((
-        (pcs.Rook, 0, 1), (pcs.Rook, 1, 0)
+    nt.assert_equal(
+        resultstore.signature(5, 5, (Giraffe, pcs.King, Giraffe)),
+        '5x5:Giraffe[1.4;]2,King1')
+
+
+def load_pieces_test():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'pieces.json')
+        with open(path, 'w') as definitions_file:
+            definitions_file.write(
+                '[{"name": "Zebra", "symbol": "Z", "leaps": [[2, 3]]}]')
+        piece_names = chessrun.load_pieces(path)
+        nt.assert_equal(piece_names['Z'], 'Zebra')
+        nt.assert_equal(
+            chessrun.parse_pieces(['2Z', '1K'], piece_names),
+            {'Zebra': 2, 'King': 1})
+
+        with open(path, 'w') as definitions_file:
+            definitions_file.write(
+                '[{"name": "Zebra2", "symbol": "K", "leaps": [[2, 3]]}]')
+        nt.assert_raises(ValueError, chessrun.load_pieces, path)
+    finally:
+        shutil.rmtree(directory)
+
+
+def symmetry_orbit_size_test():
+    group = sym.SymmetryGroup(3, 3)
+
+    nt.assert_equal(group.domain, [(0, 0), (0, 1), (1, 1)])
+    # rook in the middle of the top row, kings in the bottom corners
+    nt.assert_equal(group.orbit_size([(2, 1), (4, 6), (4, 8)]), 4)
+    nt.assert_equal(group.orbit_size([(2, 7), (4, 0), (4, 2)]), 0)
+    # four kings in the corners are symmetric under all rotations
+    nt.assert_equal(group.orbit_size([(4, 0), (4, 2), (4, 6), (4, 8)]), 1)
+
+
+def symmetry_rectangular_group_test():
+    group = sym.SymmetryGroup(2, 3)
+
+    nt.assert_equal(len(group), 4)
+    nt.assert_equal(group.domain, [(0, 0), (0, 1)])
+    # knights in the top-left and bottom-right corners are symmetric
+    # only under the rotation by 180 degrees
+    nt.assert_equal(group.orbit_size([(3, 0), (3, 5)]), 2)
+    nt.assert_equal(group.orbit_size([(0, 0), (3, 5)]), 4)
+
+
+def result_store_transposed_test():
+    path = tempfile.mkdtemp()
+    try:
+        store = resultstore.ResultStore(path)
+        compositions = set((
+            frozenset(((pcs.Rook, 0, 0), (pcs.Knight, 1, 2))),
+            frozenset(((pcs.Rook, 1, 2), (pcs.Knight, 0, 0)))
+        ))
+        store.put(2, 3, (pcs.Knight, pcs.Rook), (2, 1), compositions)
+
+        transposed = set(
+            frozenset((PieceClass, col, row)
+                      for PieceClass, row, col in composition)
+            for composition in compositions
+        )
+
+        nt.assert_equal(
+            store.get_compositions(3, 2, (pcs.Rook, pcs.Knight)), transposed)
+        nt.assert_equal(store.get_counts(3, 2, (pcs.Rook, pcs.Knight)), (2, 1))
+        nt.assert_is_none(store.get_counts(3, 2, (pcs.Rook, pcs.Rook)))
+    finally:
+        shutil.rmtree(path)
+
+
+def result_store_damaged_file_test():
+    path = tempfile.mkdtemp()
+    try:
+        store = resultstore.ResultStore(path)
+        piece_types = (pcs.Knight, pcs.Rook)
+        compositions = set((
+            frozenset(((pcs.Rook, 0, 0), (pcs.Knight, 1, 2))),
+            frozenset(((pcs.Rook, 1, 2), (pcs.Knight, 0, 0)))
+        ))
+        store.put(2, 3, piece_types, (2, 1), compositions)
+        data_files = [name for name in os.listdir(path) if '.bin' in name]
+        # only the index, its lock and the renamed data file are left
+        nt.assert_equal(len(os.listdir(path)), 3)
+
+        with open(os.path.join(path, data_files[0]), 'wb') as data:
+            data.write(b'\x00')
+        nt.assert_is_none(store.get(2, 3, piece_types))
+        nt.assert_equal(store.get_counts(2, 3, piece_types), (2, 1))
+
+        store.put(2, 3, piece_types, (2, 1), compositions)
+        os.remove(os.path.join(path, data_files[0]))
+        nt.assert_is_none(store.get_compositions(2, 3, piece_types))
+    finally:
+        shutil.rmtree(path)
+
+
+def result_store_eviction_test():
+    path = tempfile.mkdtemp()
+    try:
+        store = resultstore.ResultStore(path, max_entries=2)
+        store.put(3, 3, (pcs.King,), (9, 3))
+        store.put(4, 4, (pcs.King,), (16, 3))
+        store.get_counts(3, 3, (pcs.King,))
+        store.put(5, 5, (pcs.King,), (25, 6))
+
+        # the 4x4 entry was the least recently used one
+        nt.assert_is_none(store.get_counts(4, 4, (pcs.King,)))
+        nt.assert_equal(store.get_counts(3, 3, (pcs.King,)), (9, 3))
+        nt.assert_equal(store.get_counts(5, 5, (pcs.King,)), (25, 6))
+    finally:
+        shutil.rmtree(path)
+
+
+def solution_file_test():
+    compositions = set((
+        frozenset(((pcs.Rook, 1, 0), (pcs.King, 0, 2), (pcs.King, 2, 2))),
+        frozenset(((pcs.Rook, 0, 1), (pcs.King, 2, 0), (pcs.King, 2, 2)))
     ))
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        written = solutionfile.write_solutions(
+            path, 3, 3, (pcs.Rook, pcs.King, pcs.King), compositions)
+
+        nt.assert_equal(written, 2)
+        # 9 bytes of header, 2 type names and 2 records of 3 pieces
+        nt.assert_equal(os.path.getsize(path), 9 + 5 + 5 + 2 * 6)
+        nt.assert_equal(solutionfile.read_solutions(path), compositions)
+
+        with solutionfile.MappedSolutionReader(path) as reader:
+            nt.assert_equal(reader.header.type_names, ('King', 'Rook'))
+            nt.assert_equal(len(reader), 2)
+            nt.assert_equal(set(reader), compositions)
+            nt.assert_in(reader[1], compositions)
+    finally:
+        os.remove(path)
+
+
+def search_stats_test():
+    stats = searchstats.SearchStats()
+    piece_composer = comp.PieceComposer(
+        3, 3, (pcs.Rook, pcs.King, pcs.King), stats=stats)
+    piece_composer.compute()
 
-    piece_composer.found_compositions.add(composition)
+    nt.assert_equal(
+        stats.placements_attempted,
+        stats.nodes + stats.rejected_blocked + stats.rejected_threatens)
+    nt.assert_equal(sum(stats.backtracks), stats.nodes)
+    nt.assert_equal(len(stats.backtracks), 3)
+    # the rook is placed first, on all 3 positions not symmetric
+    # to each other
+    nt.assert_equal(stats.backtracks[0], 3)
+    nt.assert_equal(len(stats.subtree_times), 3)
+    nt.assert_equal(stats.as_dict()['nodes'], stats.nodes)
+
+    # other engines only report the statistics they collect
+    for engine in ('stack', 'propagation'):
+        stats = searchstats.SearchStats()
+        piece_composer = comp.PieceComposer(
+            3, 3, (pcs.Rook, pcs.King, pcs.King), engine=engine, stats=stats)
+        piece_composer.compute()
+        nt.assert_equal(stats.as_dict(), {'nodes': stats.nodes})
+        nt.assert_true(stats.nodes > 0)
+
+    nt.assert_raises(
+        ValueError, comp.PieceComposer(
+            3, 3, (pcs.Rook, pcs.King, pcs.King),
+            stats=searchstats.SearchStats()).count, 2)
+
+
+def stack_search_resume_test():
+    piece_types = (pcs.Rook, pcs.King, pcs.King)
+    search = stacksearch.StackSearch(3, 3, piece_types)
+    leaves = [search.positions() for _ in search.walk()]
+
+    suspended = stacksearch.StackSearch(3, 3, piece_types)
+    resumed_leaves = []
+    while True:
+        found = suspended.next_leaf(max_nodes=1)
+        if found is False:
+            break
+        if found:
+            resumed_leaves.append(suspended.positions())
+
+    nt.assert_equal(len(leaves), 4)
+    nt.assert_equal(resumed_leaves, leaves)
+
+
+def propagation_riders_test():
+    piece_types = (pcs.Queen, pcs.Rook, pcs.Bishop, pcs.Knight, pcs.King)
+    search = propagation.PropagationSearch(3, 4, piece_types)
+    rows, cols, diagonals, anti_diagonals = propagation.line_families(3, 4)
+
+    nt.assert_equal(len(rows), 3)
+    nt.assert_equal(len(diagonals), 6)
+    nt.assert_equal(
+        [(riders, len(lines)) for riders, lines, _, _ in search.families],
+        [([0, 1], 3), ([0, 1], 4), ([0, 2], 6), ([0, 2], 6)])
+
+    # folding a row onto its first square
+    mask = 1 << 7
+    for shift in propagation.fold_shifts(4, 1):
+        mask |= mask >> shift
+    nt.assert_true(mask & 1 << 4)
+
+
+def propagation_search_resume_test():
+    piece_types = (pcs.Rook, pcs.Rook, pcs.King, pcs.Knight)
+    search = propagation.PropagationSearch(4, 4, piece_types)
+    leaves = [search.positions() for _ in search.walk()]
+
+    suspended = propagation.PropagationSearch(4, 4, piece_types)
+    resumed_leaves = []
+    while True:
+        found = suspended.next_leaf(max_nodes=1)
+        if found is False:
+            break
+        if found:
+            resumed_leaves.append(suspended.positions())
+
+    nt.assert_true(leaves)
+    nt.assert_equal(resumed_leaves, leaves)
+
+
+def chessboard_pieces_test():
+    # pieces taken back during the search leave the chessboard
+    for engine in ('set', 'bitboard'):
+        piece_composer = comp.PieceComposer(
+            4, 4, (pcs.King, pcs.Queen, pcs.Bishop, pcs.Knight),
+            engine=engine)
+        piece_composer.count()
+        nt.assert_equal(len(piece_composer.chessboard.pieces), 0)
+
+
+def chessboard_legal_count_test():
+    for chessboard in (csb.Chessboard(4, 5), bcb.BitChessboard(4, 5)):
+        nt.assert_equal(chessboard.free_count(), 20)
+        chessboard.add(pcs.Rook(), (1, 1))
+
+        nt.assert_equal(chessboard.free_count(), 12)
+        # a bishop on the diagonals of the rook would attack it
+        nt.assert_equal(chessboard.legal_count(pcs.Bishop), 7)
+        nt.assert_equal(chessboard.legal_count(pcs.Rook), 12)
+
+
+def numpy_attack_matrix_test():
+    if npattack.np is None:
+        raise unittest.SkipTest("NumPy is not installed")
+
+    for PieceClass in (pcs.King, pcs.Queen, pcs.Bishop, pcs.Rook,
+                       pcs.Knight):
+        matrix = npattack.attack_matrix(PieceClass, 4, 6)
+        masks = pcs.attack_table(PieceClass, 4, 6).masks
+        nt.assert_equal(
+            [sum(1 << int(target) for target in row.nonzero()[0])
+             for row in matrix],
+            list(masks)
+        )
+
+
+def numpy_validate_test():
+    if npattack.np is None:
+        raise unittest.SkipTest("NumPy is not installed")
+
+    piece_types = (pcs.Rook, pcs.King, pcs.King)
+    # columns are King, King, Rook
+    squares = [
+        [0, 2, 7],      # valid
+        [0, 0, 7],      # two pieces on one square
+        [0, 4, 7],      # the kings attack each other
+        [0, 2, 6],      # the rook attacks a king
+        [0, 2, 9]       # the rook is outside of the chessboard
+    ]
+    nt.assert_equal(
+        list(npattack.validate(squares, piece_types, 3, 3)),
+        [True, False, False, False, False]
+    )
 
-    piece_composer.extract_symmetric_compositions()
+    compositions = [
+        frozenset([(pcs.King, 0, 0), (pcs.King, 0, 2), (pcs.Rook, 2, 1)]),
+        frozenset([(pcs.King, 0, 0), (pcs.King, 0, 2), (pcs.Rook, 2, 1)]),
+        frozenset([(pcs.King, 0, 0), (pcs.Rook, 0, 2), (pcs.Rook, 2, 1)])
+    ]
+    nt.assert_equal(
+        npattack.validate_compositions(compositions, 3, 3, piece_types),
+        (3, 1, 1)
+    )
 
-    nt.assert_in(composition, piece_composer.found_compositions)
-    nt.assert_in(expected_symmetric, piece_composer.found_compositions)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'solutions.bin')
+        solutionfile.write_solutions(
+            path, 3, 3, piece_types, compositions[:1])
+        with open(path, 'ab') as solution_file:
+            # a record of two kings on one square and a duplicate
+            solution_file.write(b'\x00\x00\x00\x00\x01\x07')
+            solution_file.write(b'\x00\x00\x00\x02\x01\x07')
+
+        nt.assert_equal(
+            npattack.validate_solution_file(path), (3, 1, 1))
+    finally:
+        shutil.rmtree(directory)
+
+
+def chessrun_infeasible_test():
+    nt.assert_true(chessrun.infeasible(1, 5, {'Queen': 2}))
+    nt.assert_true(chessrun.infeasible(3, 4, {'Queen': 1, 'Rook': 3}))
+    nt.assert_true(chessrun.infeasible(2, 2, {'Knight': 5}))
+    nt.assert_true(chessrun.infeasible(3, 3, {'King': 5}))
+    nt.assert_true(chessrun.infeasible(2, 3, {'Bishop': 5}))
+    nt.assert_false(chessrun.infeasible(3, 3, {'King': 4}))
+    nt.assert_false(chessrun.infeasible(4, 4, {'Queen': 4}))
+    nt.assert_false(chessrun.infeasible(1, 5, {'Bishop': 5}))
+
+    # bounds of infeasible() are lower than the solution counts
+    for rows, cols, piece_counts in [
+            (3, 3, {'King': 4}), (2, 3, {'Bishop': 4}),
+            (3, 3, {'Rook': 2, 'Queen': 1})]:
+        composer = comp.PieceComposer(
+            rows, cols, chessrun.piece_types(piece_counts))
+        nt.assert_true(composer.count()[0] > 0)
+
+
+def chessrun_choices_test():
+    nt.assert_equal(
+        set(chessrun.ENGINES), set(comp.PieceComposer.ENGINES))
+    nt.assert_equal(chessrun.ORDERINGS, comp.PieceComposer.ORDERINGS)
+    nt.assert_equal(
+        (None,) + chessrun.PRUNES, comp.PieceComposer.PRUNES)